@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""Benchmarks of the hot paths of the tracker and the sniffer.
+
+Usage:
+    bench.py generate <dir> [--rows=<n>] [--seed=<n>] [--storage=<name>]
+    bench.py pcap <file> [--rows=<n>] [--seed=<n>]
+    bench.py run <dir> [--storage=<name>] [--packets=<n>] [--repeat=<n>]
+                       [--output=<file>]
+    bench.py -h | --help
+
+Options:
+    -h --help           Show help.
+    --rows=<n>          Number of generated requests. [default: 100000]
+    --seed=<n>          Seed of the generator. [default: 0]
+    --storage=<name>    Storage backend: json, binary, segmented,
+                        compressed or sqlite. [default: json]
+    --packets=<n>       Number of packets of the capture benchmarks.
+                        [default: 20000]
+    --repeat=<n>        Number of runs of each benchmark, the fastest run is
+                        reported. [default: 3]
+    --output=<file>     Write the results to this file instead of stdout.
+
+Commands:
+    generate        Write a synthetic request log to a storage directory.
+    pcap            Write synthetic probe requests to a pcap file.
+    run             Time the queries on a generated storage directory and the
+                    capture path, and print the results as JSON.
+"""
+
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+# run from a source checkout:
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from docopt import docopt
+from wifitracker import __version__
+from wifitracker.storage import open_storage
+from wifitracker.tracker import Tracker
+
+from generator import generate_requests, probe_request_frame, \
+    write_pcap, write_storage
+
+
+def timed(function, repeat, setup=None):
+    """Run function repeat times and return the durations in seconds and the
+    result of the last run. setup is called before each run, untimed."""
+    runs = []
+    result = None
+    for i in xrange(repeat):
+        if setup:
+            setup()
+        start = time.time()
+        result = function()
+        runs.append(time.time() - start)
+    return runs, result
+
+
+def record(results, name, runs, rows=None):
+    best = min(runs)
+    entry = OrderedDict([('name', name),
+                         ('seconds', best),
+                         ('runs', runs)])
+    if rows is not None:
+        entry['rows'] = rows
+        entry['rows_per_second'] = rows / best if best else None
+    results.append(entry)
+    sys.stderr.write('{:<32} {:10.4f}s {}\n'.format(
+        name, best, '{:,.0f} rows/s'.format(entry['rows_per_second'])
+        if rows else ''))
+
+
+def _remove(filename):
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+def bench_queries(results, directory, storage, repeat):
+    options = {'bucket': 'hour'} if storage == 'segmented' else {}
+    engines = ['python']
+    from wifitracker import arrays
+    if arrays.available():
+        engines.append('numpy')
+    tracker = Tracker(directory, storage=storage, storage_options=options,
+                      engine='python', live=False)
+
+    def scan():
+        return sum(len(chunk) for chunk in tracker._read_requests_chunk())
+    runs, rows = timed(scan, repeat)
+    record(results, '_read_requests_chunk', runs, rows)
+
+    for engine in engines:
+        tracker = Tracker(directory, storage=storage,
+                          storage_options=options, engine=engine, live=False)
+
+        def cold():
+            _remove(tracker.snapshot_filename)
+        runs, devices = timed(tracker.get_devices, repeat, cold)
+        record(results, 'get_devices[{}]'.format(engine), runs, rows)
+        runs, stations = timed(tracker.get_stations, repeat, cold)
+        record(results, 'get_stations[{}]'.format(engine), runs, rows)
+    runs, devices = timed(tracker.get_devices, repeat)
+    record(results, 'get_devices[snapshot]', runs)
+
+    def unindexed():
+        tracker.index.close()
+        _remove(tracker.index_filename)
+    runs, _ = timed(tracker.update_index, 1, unindexed)
+    record(results, 'update_index', runs, rows)
+    # the device with the most requests:
+    device_mac = max(devices.values(), key=lambda d: sum(
+        seen[2] for seen in d.ssid_stats.values())).device_mac
+    runs, _ = timed(lambda: tracker.get_device(device_mac), repeat)
+    record(results, 'get_device[index]', runs)
+    ssid = max(stations.values(), key=lambda s: len(s.device_stats)).ssid
+    runs, _ = timed(lambda: tracker.get_station(ssid), repeat)
+    record(results, 'get_station[index]', runs)
+
+
+def bench_write(results, storage, packets, repeat):
+    requests = list(generate_requests(packets, seed=1))
+    options = {'bucket': 'hour'} if storage == 'segmented' else {}
+    directories = []
+
+    def setup():
+        directories.append(tempfile.mkdtemp())
+
+    def write():
+        tracker = Tracker(directories[-1], storage=storage,
+                          storage_options=options, index=False, live=False)
+        for request in requests:
+            tracker._write_request(request)
+        tracker.close()
+    try:
+        runs, _ = timed(write, repeat, setup)
+    finally:
+        for directory in directories:
+            shutil.rmtree(directory)
+    record(results, '_write_request', runs, packets)
+
+
+def bench_capture(results, packets, repeat):
+    from wifitracker import dot11, sniffer
+    frames = [probe_request_frame(request) for request
+              in generate_requests(packets, seed=2)]
+    now = datetime.datetime.now()
+
+    def queue():
+        sniffer.QUEUE = sniffer.CaptureQueue(packets + 1)
+
+    def raw():
+        for frame in frames:
+            sniffer.raw_packet_handler(frame)
+    runs, _ = timed(raw, repeat, queue)
+    record(results, 'raw_packet_handler', runs, packets)
+    runs, _ = timed(lambda: [dot11.parse_probe_request(frame, now)
+                             for frame in frames], repeat)
+    record(results, 'parse_probe_request', runs, packets)
+    from scapy.all import RadioTap
+    scapy_packets = [RadioTap(frame) for frame in frames]
+
+    def scapy():
+        for packet in scapy_packets:
+            sniffer.packet_handler(packet)
+    runs, _ = timed(scapy, repeat, queue)
+    record(results, 'packet_handler', runs, packets)
+    runs, _ = timed(lambda: [sniffer.summarize_probe_request(packet, now)
+                             for packet in scapy_packets], repeat)
+    record(results, 'summarize_probe_request', runs, packets)
+
+
+def run(args):
+    directory = args['<dir>']
+    storage = args['--storage']
+    packets = int(args['--packets'])
+    repeat = int(args['--repeat'])
+    results = []
+    bench_queries(results, directory, storage, repeat)
+    bench_write(results, storage, packets, repeat)
+    bench_capture(results, packets, repeat)
+    report = OrderedDict([
+        ('version', __version__),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('date', datetime.datetime.now().isoformat()),
+        ('parameters', OrderedDict([('directory', directory),
+                                    ('storage', storage),
+                                    ('packets', packets),
+                                    ('repeat', repeat)])),
+        ('results', results)])
+    dump = json.dumps(report, indent=4, separators=(',', ': '))
+    if args['--output']:
+        with open(args['--output'], 'w') as file:
+            file.write(dump + '\n')
+    else:
+        print dump
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    rows = int(args['--rows'])
+    seed = int(args['--seed'])
+    if args['generate']:
+        storage = args['--storage']
+        options = {'bucket': 'hour'} if storage == 'segmented' else {}
+        if not os.path.isdir(args['<dir>']):
+            os.makedirs(args['<dir>'])
+        target = open_storage(storage, args['<dir>'],
+                              buffer_size=4 * 1024 * 1024,
+                              flush_interval=None, **options)
+        try:
+            count = write_storage(target, generate_requests(rows, seed))
+        finally:
+            target.close()
+        print "Generated {} requests.".format(count)
+    elif args['pcap']:
+        count = write_pcap(args['<file>'], generate_requests(rows, seed))
+        print "Generated {} probe requests.".format(count)
+    elif args['run']:
+        run(args)
@@ -0,0 +1,135 @@
+"""Deterministic generator of synthetic probe requests for benchmarks.
+
+The requests resemble real captures: a few devices and SSIDs account for
+most of the requests (Zipf distribution), a share of the requests is sent
+from randomized MAC addresses, which are used for a single burst only, and
+every probe is sent as a burst of identical requests within milliseconds
+(e.g. once per channel).
+"""
+
+import bisect
+import datetime
+import random
+import struct
+import time
+
+from wifitracker.tracker import EPOCH, ProbeRequest, _from_epoch_us
+
+START = datetime.datetime(2020, 1, 1)
+# radiotap header with the dBm antenna signal field:
+RADIOTAP = struct.Struct('<BBHIb')
+RADIOTAP_SIGNAL = 1 << 5
+PCAP_HEADER = struct.Struct('<IHHiIII')
+PCAP_RECORD = struct.Struct('<IIII')
+LINKTYPE_IEEE802_11_RADIOTAP = 127
+BROADCAST = '\xff' * 6
+RATES = '\x01\x08\x02\x04\x0b\x16\x0c\x12\x18\x24'
+
+
+class Zipf(object):
+    """Samples ranks 0 to n - 1 with probabilities proportional to
+    1 / (rank + 1) ** exponent."""
+
+    def __init__(self, n, exponent, rng):
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for rank in xrange(n):
+            total += 1.0 / (rank + 1) ** exponent
+            self.cumulative.append(total)
+        self.total = total
+
+    def sample(self):
+        return bisect.bisect(self.cumulative, self.rng.random() * self.total)
+
+
+def _mac(number):
+    mac = '{:012x}'.format(number)
+    return ':'.join([mac[i:i + 2] for i in xrange(0, 12, 2)])
+
+
+def generate_requests(rows, seed=0, devices=None, ssids=None, exponent=1.1,
+                      randomized=0.3, wildcard=0.4, burst=3, rate=50.0):
+    """Yield rows probe requests in the order of their capture timestamps.
+    The same arguments always yield the same requests.
+
+    Keyword arguments:
+    devices -- number of devices with a fixed MAC, rows // 200 by default
+    ssids -- number of SSIDs, rows // 2000 by default
+    exponent -- exponent of the Zipf distributions of devices and SSIDs
+    randomized -- share of the probes sent from a randomized MAC
+    wildcard -- share of the probes without SSID
+    burst -- mean number of requests per probe
+    rate -- mean number of probes per second
+    """
+    rng = random.Random(seed)
+    devices = devices or max(100, rows // 200)
+    ssids = ssids or max(50, rows // 2000)
+    device_ranks = Zipf(devices, exponent, rng)
+    ssid_ranks = Zipf(ssids, exponent, rng)
+    ssid_names = ['ssid-{}'.format(i) for i in xrange(ssids)]
+    # the networks each device knows, drawn when it probes the first time:
+    known = {}
+    capture_us = int((START - EPOCH).total_seconds()) * 1000000
+    count = 0
+    while count < rows:
+        capture_us += int(rng.expovariate(rate) * 1000000)
+        if rng.random() < randomized:
+            # locally administered, unicast:
+            mac = _mac(rng.getrandbits(48) & ~(1 << 40) | (1 << 41))
+            ssid = None
+        else:
+            rank = device_ranks.sample()
+            mac = _mac(0x001122000000 + rank)
+            if rank not in known:
+                known[rank] = [ssid_names[ssid_ranks.sample()]
+                               for i in xrange(rng.randint(1, 5))]
+            ssid = None if rng.random() < wildcard else \
+                rng.choice(known[rank])
+        signal = rng.randint(-90, -30)
+        size = 1 + int(rng.expovariate(1.0 / (burst - 1))) if burst > 1 else 1
+        for i in xrange(min(size, rows - count)):
+            yield ProbeRequest.from_us(mac, capture_us + i * 300, ssid,
+                                       signal + rng.randint(-2, 2))
+        count += size
+        # the next probe follows the end of the burst, like the sniffer
+        # writes the requests in capture order:
+        capture_us += (size - 1) * 300
+
+
+def write_storage(storage, requests):
+    """Append the requests to a storage backend. Returns their number."""
+    count = 0
+    for request in requests:
+        storage.append(request)
+        count += 1
+    storage.flush()
+    return count
+
+
+def probe_request_frame(request):
+    """Build the radiotap header and 802.11 frame of a probe request."""
+    mac = request.source_mac.replace(':', '').decode('hex')
+    ssid = request.target_ssid or ''
+    signal = request.signal_strength
+    return (RADIOTAP.pack(0, 0, RADIOTAP.size, RADIOTAP_SIGNAL, signal) +
+            '\x40\x00\x00\x00' + BROADCAST + mac + BROADCAST + '\x00\x00' +
+            struct.pack('BB', 0, len(ssid)) + ssid + RATES)
+
+
+def write_pcap(filename, requests):
+    """Write the requests as radiotap frames to a pcap file. Returns their
+    number."""
+    count = 0
+    with open(filename, 'wb') as file:
+        file.write(PCAP_HEADER.pack(0xa1b2c3d4, 2, 4, 0, 0, 65535,
+                                    LINKTYPE_IEEE802_11_RADIOTAP))
+        for request in requests:
+            frame = probe_request_frame(request)
+            # pcap timestamps are UTC, captures use local time:
+            dts = _from_epoch_us(request.capture_us)
+            file.write(PCAP_RECORD.pack(int(time.mktime(dts.timetuple())),
+                                        dts.microsecond, len(frame),
+                                        len(frame)) + frame)
+            count += 1
+    return count
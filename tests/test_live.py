@@ -0,0 +1,78 @@
+import datetime
+import json
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from wifitracker import live
+from wifitracker.live import LiveAggregate, LiveServer
+from wifitracker.tracker import ProbeRequest, Snapshot, Tracker
+
+SSIDS = ['caf\xc3\xa9', 'a\\b', 'plain']
+
+
+def _known_ssids(devices):
+    return dict((mac, device.known_ssids) for mac, device in devices.items())
+
+
+class LiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_live_matches_scan(self):
+        for storage in ('json', 'binary', 'sqlite'):
+            storage_dir = os.path.join(self.directory, storage)
+            os.makedirs(storage_dir)
+            tracker = Tracker(storage_dir, storage=storage, live=False,
+                              flush_interval=None)
+            aggregate = LiveAggregate(escape_ssid=tracker.storage.escape_ssid)
+            start = datetime.datetime(2020, 1, 1)
+            for i in range(30):
+                request = ProbeRequest(
+                    '00:11:22:33:44:{:02x}'.format(i % 4),
+                    start + datetime.timedelta(seconds=i),
+                    SSIDS[i % len(SSIDS)], -40)
+                tracker.add_request(request)
+                aggregate.add_request(request)
+            tracker.close()
+            tracker = Tracker(storage_dir, storage=storage, live=False)
+            snapshot = Snapshot.from_dump(aggregate.query('devices'))
+            self.assertEqual(_known_ssids(snapshot.devices),
+                             _known_ssids(tracker.get_devices()), storage)
+            for ssid in tracker.get_stations():
+                dump = aggregate.query('station', ssid)
+                station = Snapshot.from_dump(dump).stations[ssid]
+                self.assertEqual(
+                    station.associated_devices,
+                    tracker.get_station(ssid).associated_devices, storage)
+            tracker.close()
+
+    def test_unserializable_result(self):
+        filename = os.path.join(self.directory, 'live.sock')
+        server = LiveServer(filename, LiveAggregate(),
+                            stats=lambda: {'ssid': 'bad\xff'})
+        server.start()
+        try:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.settimeout(5.0)
+            client.connect(filename)
+            client.sendall('{"query": "stats"}\n')
+            response = json.loads(client.makefile().readline())
+            client.close()
+            self.assertFalse(response['ok'])
+            self.assertIn('decode', response['error'])
+            # the server keeps answering queries:
+            self.assertEqual(live.request(filename, 'devices')['devices'],
+                             [])
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # python3
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from wifitracker.oui import VendorCache, VendorResolver, get_oui
+
+# responses of the stub server by OUI:
+VENDORS = dict(('00:00:{:02x}'.format(i), 'Vendor {}'.format(i))
+               for i in range(1, 9))
+UNKNOWN = '00:00:10'
+ERROR = '00:00:11'
+SLOW = '00:00:12'
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.requests = {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        oui = get_oui(self.path.rsplit('/', 1)[-1])
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            server.requests[oui] = server.requests.get(oui, 0) + 1
+        try:
+            if oui == SLOW:
+                time.sleep(1.0)
+            else:
+                time.sleep(0.1)
+            if oui in VENDORS:
+                body = json.dumps([{'company': VENDORS[oui],
+                                    'country': 'AT'}])
+                self.send_response(200)
+            elif oui == ERROR:
+                body = 'error'
+                self.send_response(503)
+            else:
+                body = '[]'
+                self.send_response(404)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except IOError:
+            # the client gave up waiting
+            pass
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class VendorResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = _Server()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}/api/v2/{{}}'.format(
+            self.server.server_address[1])
+        self.cache = VendorCache(os.path.join(self.directory, 'vendors.db'))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def _resolver(self, **kwargs):
+        options = dict(url=self.url, concurrency=4, rate=1000.0, retries=1,
+                       backoff=0.01, timeout=0.3, deadline=10,
+                       cache=self.cache)
+        options.update(kwargs)
+        return VendorResolver(**options)
+
+    def test_concurrent_resolution(self):
+        # two MACs of each OUI, looked up once per OUI:
+        macs = [oui + suffix for oui in sorted(VENDORS)
+                for suffix in (':00:00:01', ':00:00:02')]
+        resolver = self._resolver()
+        vendors = resolver.resolve(macs)
+        for mac in macs:
+            self.assertEqual(vendors[mac], {'company': VENDORS[mac[:8]],
+                                            'country': 'AT'})
+        self.assertEqual(self.server.requests,
+                         dict((oui, 1) for oui in VENDORS))
+        self.assertTrue(1 < self.server.max_active <= 4)
+        # the second resolution is answered by the cache:
+        self.assertEqual(resolver.resolve(macs), vendors)
+        self.assertEqual(resolver.stats()['requests'], len(VENDORS))
+
+    def test_errors(self):
+        macs = [UNKNOWN + ':00:00:01', ERROR + ':00:00:01',
+                SLOW + ':00:00:01', '00:00:01:00:00:01']
+        resolver = self._resolver()
+        vendors = resolver.resolve(macs)
+        self.assertEqual(vendors, {macs[0]: None, macs[1]: None,
+                                   macs[2]: None,
+                                   macs[3]: {'company': 'Vendor 1',
+                                             'country': 'AT'}})
+        # unknown vendors are not retried, errors and timeouts are:
+        self.assertEqual(self.server.requests[UNKNOWN], 1)
+        self.assertEqual(self.server.requests[ERROR], 2)
+        self.assertEqual(resolver.stats()['failed'], 3)
+        self.assertEqual(resolver.stats()['retried'], 2)
+        # failed lookups are cached as negative entries:
+        for mac in macs[:3]:
+            self.assertEqual(self.cache.get(mac), (True, None))
+
+    def test_deadline(self):
+        # the worker may still wait for the response after the deadline:
+        resolver = self._resolver(timeout=5, deadline=0.5, retries=0,
+                                  cache=None)
+        start = time.time()
+        vendors = resolver.resolve([SLOW + ':00:00:01'])
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(vendors, {SLOW + ':00:00:01': None})
+
+
+if __name__ == '__main__':
+    unittest.main()
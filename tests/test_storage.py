@@ -0,0 +1,75 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from wifitracker.storage import STORAGES, convert, open_storage
+from wifitracker.tracker import ProbeRequest, _escape_ssid
+
+# a backslash, a control character, non ASCII and invalid UTF-8:
+SSIDS = ['a\\b', 'a\x08b', 'caf\xc3\xa9', 'bad\xff', u'n\xe4me', "it's",
+         'a"b', None]
+
+
+def _requests():
+    start = datetime.datetime(2020, 1, 1)
+    return [ProbeRequest('00:11:22:33:44:{:02x}'.format(i),
+                         start + datetime.timedelta(seconds=i), ssid, -40)
+            for i, ssid in enumerate(SSIDS)]
+
+
+def _read(storage):
+    return [request.target_ssid for entries, end in storage.read_tail(0)
+            for offset, request in entries]
+
+
+class StorageSsidTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _storage(self, name, subdirectory=None):
+        storage_dir = os.path.join(self.directory, subdirectory or name)
+        if not os.path.exists(storage_dir):
+            os.makedirs(storage_dir)
+        return open_storage(name, storage_dir, flush_interval=None)
+
+    def _write(self, name):
+        storage = self._storage(name)
+        for request in _requests():
+            storage.append(request)
+        storage.close()
+        return self._storage(name)
+
+    def test_round_trip(self):
+        expected = [_escape_ssid(ssid) if ssid else None for ssid in SSIDS]
+        for name in STORAGES:
+            storage = self._write(name)
+            self.assertEqual(_read(storage), expected, name)
+            self.assertEqual([storage.escape_ssid(ssid) for ssid in SSIDS
+                              if ssid], [ssid for ssid in expected if ssid],
+                             name)
+            storage.close()
+
+    def test_convert(self):
+        for name in STORAGES:
+            source = self._write(name)
+            for target_name in STORAGES:
+                target = self._storage(target_name,
+                                       name + '-' + target_name)
+                convert(source, target)
+                target.close()
+                target = self._storage(target_name,
+                                       name + '-' + target_name)
+                self.assertEqual(_read(target), _read(source),
+                                 name + ' to ' + target_name)
+                target.close()
+            source.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import datetime
+import json
+import shutil
+import tempfile
+import unittest
+
+from wifitracker.tracker import ProbeRequest, Tracker, json_compact
+
+
+class TrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_unknown_device(self):
+        tracker = Tracker(self.directory, live=False, flush_interval=None)
+        tracker.add_request(ProbeRequest('00:11:22:33:44:55',
+                                         datetime.datetime(2020, 1, 1),
+                                         'ssid', -40))
+        tracker.close()
+        tracker = Tracker(self.directory, live=False)
+        device = json.loads(json_compact(
+            tracker.get_device('00:11:22:33:44:66')))
+        self.assertIsNone(device['last_seen_dts'])
+        self.assertEqual(device['known_ssids'], [])
+        tracker.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
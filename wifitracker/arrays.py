@@ -0,0 +1,207 @@
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from wifitracker.storage import BinaryStorage
+from wifitracker.tracker import Device, Station, _epoch_us, _from_epoch_us
+
+log = logging.getLogger(__name__)
+
+MAC_SHIFTS = [40, 32, 24, 16, 8, 0]
+
+
+def available():
+    """Tell whether NumPy is installed, which is required by this module."""
+    return np is not None
+
+
+def native(storage):
+    """Tell whether the columns of the storage are loaded directly, without
+    decoding each request."""
+    return isinstance(storage, BinaryStorage)
+
+
+class Columns(object):
+    """Captured requests as column arrays: mac (uint64), dts (int64,
+    microseconds since the epoch), ssid_id (int32) and rssi (int8).
+
+    ssids -- list of SSIDs indexed by ssid_id, ssid_id 0 means no SSID
+    end -- position in the storage after the last loaded request
+    last -- last capture timestamps (int64) of coalesced requests, None if
+            there are no coalesced requests
+    count -- number of coalesced requests (int64), None if there are no
+             coalesced requests
+    """
+
+    def __init__(self, mac, dts, ssid_id, rssi, ssids, end, last=None,
+                 count=None):
+        self.mac = mac
+        self.dts = dts
+        self.ssid_id = ssid_id
+        self.rssi = rssi
+        self.ssids = ssids
+        self.end = end
+        self.last = last
+        self.count = count
+
+    def __len__(self):
+        return len(self.mac)
+
+
+def load_columns(storage, start=0, chunk_size=100000):
+    """Load all requests written to the storage after the given position."""
+    if native(storage):
+        return _load_binary_columns(storage, start)
+    macs, dts, ssid_ids, rssis = [], [], [], []
+    # (index, last_us, count) of coalesced requests:
+    coalesced = []
+    mac_numbers = {}
+    ssids = [None]
+    interned = {None: 0}
+    end = start
+    if storage.exists():
+        for entries, end in storage.read_tail(start, chunk_size):
+            for offset, request in entries:
+                mac = request.source_mac
+                if mac not in mac_numbers:
+                    mac_numbers[mac] = int(mac.replace(':', ''), 16)
+                macs.append(mac_numbers[mac])
+                capture_us = request.capture_us
+                dts.append(BinaryStorage.NO_DTS if capture_us is None
+                           else capture_us)
+                ssid = request.target_ssid or None
+                if ssid not in interned:
+                    interned[ssid] = len(ssids)
+                    ssids.append(ssid)
+                ssid_ids.append(interned[ssid])
+                rssi = request.signal_strength
+                rssis.append(BinaryStorage.NO_RSSI if rssi is None else rssi)
+                if request.count != 1:
+                    coalesced.append((len(dts) - 1, request.last_us,
+                                      request.count))
+    columns = Columns(np.array(macs, dtype=np.uint64),
+                      np.array(dts, dtype=np.int64),
+                      np.array(ssid_ids, dtype=np.int32),
+                      np.array(rssis, dtype=np.int8),
+                      ssids, end)
+    if coalesced:
+        index, last, count = zip(*coalesced)
+        columns.last = columns.dts.copy()
+        columns.last[list(index)] = [BinaryStorage.NO_DTS if last_us is None
+                                     else last_us for last_us in last]
+        columns.count = np.ones(len(columns), dtype=np.int64)
+        columns.count[list(index)] = count
+    return columns
+
+
+def _load_binary_columns(storage, start):
+    """Load the records of a binary storage directly from its memory map."""
+    dtype = np.dtype([('mac', 'u1', 6), ('dts', '<i8'), ('rssi', 'i1'),
+                      ('ssid_id', '<u4')])
+    assert dtype.itemsize == storage.RECORD.size
+    end = storage.size()
+    count = max(0, end - start) // dtype.itemsize
+    if not count:
+        return Columns(np.zeros(0, np.uint64), np.zeros(0, np.int64),
+                       np.zeros(0, np.int32), np.zeros(0, np.int8),
+                       [None], start)
+    records = storage._map()
+    try:
+        view = np.frombuffer(records, dtype=dtype, count=count, offset=start)
+        shifts = np.array(MAC_SHIFTS, dtype=np.uint64)
+        mac = np.left_shift(view['mac'].astype(np.uint64), shifts).sum(
+            axis=1, dtype=np.uint64)
+        columns = Columns(mac, view['dts'].astype(np.int64),
+                          view['ssid_id'].astype(np.int32),
+                          view['rssi'].astype(np.int8), None,
+                          start + count * dtype.itemsize)
+        del view
+    finally:
+        records.close()
+    storage._load_ssids()
+    columns.ssids = list(storage._ssids)
+    return columns
+
+
+def aggregate(columns, load_dts=None, since=None):
+    """Build the devices and stations of all requests captured before
+    load_dts and not before since. Instead of iterating over each request,
+    the requests are grouped with a few vectorized passes.
+
+    Returns a tuple of the dicts of devices and stations, like
+    Tracker.get_devices and Tracker.get_stations.
+    """
+    mac, dts, ssid_id = columns.mac, columns.dts, columns.ssid_id
+    last = dts if columns.last is None else columns.last
+    count = columns.count
+    if load_dts or since:
+        mask = np.ones(len(dts), dtype=bool)
+        if load_dts:
+            mask &= dts < _epoch_us(load_dts)
+        if since:
+            mask &= dts >= _epoch_us(since)
+        mac, dts, ssid_id, last = mac[mask], dts[mask], ssid_id[mask], \
+            last[mask]
+        if count is not None:
+            count = count[mask]
+    devices = {}
+    stations = {}
+    if not len(mac):
+        return devices, stations
+    unique_macs, inverse = np.unique(mac, return_inverse=True)
+    # latest capture timestamp per device:
+    order = np.argsort(inverse, kind='mergesort')
+    starts = np.flatnonzero(np.r_[True, np.diff(inverse[order]) != 0])
+    last_seen = np.maximum.reduceat(last[order], starts)
+    ids = [_mac_str(m) for m in unique_macs.tolist()]
+    for id, last_seen_dts in zip(ids, last_seen.tolist()):
+        if last_seen_dts == BinaryStorage.NO_DTS:
+            last_seen_dts = None
+        else:
+            last_seen_dts = _from_epoch_us(last_seen_dts)
+        devices[id] = Device(id, last_seen_dts=last_seen_dts)
+    # distinct (device, SSID) pairs in the order of their first occurrence,
+    # with their first_seen, last_seen and count:
+    has_ssid = ssid_id > 0
+    width = len(columns.ssids)
+    pairs = inverse[has_ssid].astype(np.int64) * width + ssid_id[has_ssid]
+    if not len(pairs):
+        return devices, stations
+    pair_dts = dts[has_ssid]
+    order = np.argsort(pairs, kind='mergesort')
+    sorted_pairs = pairs[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(sorted_pairs) != 0])
+    if count is None:
+        counts = np.diff(np.r_[starts, len(sorted_pairs)])
+    else:
+        counts = np.add.reduceat(count[has_ssid][order], starts)
+    sorted_dts = pair_dts[order]
+    known = sorted_dts != BinaryStorage.NO_DTS
+    first_seen = np.minimum.reduceat(
+        np.where(known, sorted_dts, np.iinfo(np.int64).max), starts)
+    last_seen = np.maximum.reduceat(last[has_ssid][order], starts)
+    no_first = np.iinfo(np.int64).max
+    by_occurrence = np.argsort(order[starts], kind='mergesort')
+    ssids = columns.ssids
+    for pair, first_us, last_us, count in zip(
+            sorted_pairs[starts][by_occurrence].tolist(),
+            first_seen[by_occurrence].tolist(),
+            last_seen[by_occurrence].tolist(),
+            counts[by_occurrence].tolist()):
+        id = ids[pair // width]
+        ssid = ssids[pair % width]
+        first_us = None if first_us == no_first else first_us
+        last_us = None if last_us == BinaryStorage.NO_DTS else last_us
+        devices[id].ssid_stats[ssid] = [first_us, last_us, count]
+        if ssid not in stations:
+            stations[ssid] = Station(ssid)
+        stations[ssid].device_stats[id] = [first_us, last_us, count]
+    return devices, stations
+
+
+def _mac_str(mac):
+    mac = '{:012x}'.format(mac)
+    return ':'.join([mac[i:i + 2] for i in xrange(0, 12, 2)])
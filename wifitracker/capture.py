@@ -0,0 +1,259 @@
+import datetime
+import heapq
+import logging
+import multiprocessing
+import os
+import signal
+import subprocess
+import time
+from threading import Event, Thread
+try:
+    from queue import Empty  # try python3
+except ImportError:
+    from Queue import Empty
+
+from wifitracker import dot11
+from wifitracker.pcap import (LINKTYPE_IEEE802_11,
+                              LINKTYPE_IEEE802_11_RADIOTAP, read_pcap)
+from wifitracker.tracker import _epoch_us
+
+log = logging.getLogger(__name__)
+
+# interfaces named replay:<file> replay a pcap or pcapng file:
+REPLAY_PREFIX = 'replay:'
+# radiotap header without fields, prepended to replayed 802.11 frames:
+EMPTY_RADIOTAP = '\x00\x00\x08\x00\x00\x00\x00\x00'
+
+
+def is_replay(interface):
+    return interface.startswith(REPLAY_PREFIX)
+
+
+def parse_hop_schedule(spec, dwell=0.5):
+    """Parse a channel hop schedule like '1,6,11' or '1:0.2,6:1,11:0.2' into a
+    list of (channel, dwell) tuples. Channels without a dwell time are kept
+    for dwell seconds."""
+    schedule = []
+    for entry in spec.split(','):
+        channel, _, seconds = entry.strip().partition(':')
+        try:
+            schedule.append((int(channel),
+                             float(seconds) if seconds else float(dwell)))
+        except ValueError:
+            raise ValueError("Invalid channel hop schedule: {}".format(spec))
+    return schedule
+
+
+def set_channel(interface, channel):
+    with open(os.devnull, 'w') as devnull:
+        exit = subprocess.call(['iwconfig', interface, 'channel',
+                                str(channel)], stdout=devnull, stderr=devnull)
+    if exit != 0:
+        log.warn("Unable to set channel {} on {}".format(channel, interface))
+
+
+class ChannelHopper(Thread):
+    """Switches the channel of an interface according to a schedule of
+    (channel, dwell) tuples, beginning with the entry at offset."""
+
+    def __init__(self, interface, schedule, offset=0):
+        super(ChannelHopper, self).__init__()
+        self.setDaemon(True)
+        self.interface = interface
+        self.schedule = schedule
+        self.offset = offset
+        self._stopped = Event()
+
+    def run(self):
+        i = self.offset
+        while not self._stopped.is_set():
+            channel, dwell = self.schedule[i % len(self.schedule)]
+            set_channel(self.interface, channel)
+            self._stopped.wait(dwell)
+            i += 1
+
+    def stop(self):
+        self._stopped.set()
+
+
+def replay(filename, handler, speed=1.0):
+    """Pass the frames of a pcap or pcapng file with their capture timestamps
+    to handler(capture_us, frame), like a capture of an interface in monitor
+    mode. 802.11 frames without radiotap header get an empty one.
+
+    speed -- replay the frames speed times faster than they were captured, or
+             as fast as possible if 0
+    """
+    start = None
+    with open(filename, 'rb') as file:
+        for capture_dts, linktype, frame in read_pcap(file):
+            if linktype == LINKTYPE_IEEE802_11:
+                frame = EMPTY_RADIOTAP + frame
+            elif linktype != LINKTYPE_IEEE802_11_RADIOTAP:
+                raise ValueError("Unsupported link type {} in {}".format(
+                    linktype, filename))
+            capture_us = _epoch_us(capture_dts)
+            if speed:
+                if start is None:
+                    start = (capture_us, time.time())
+                delay = (start[1] + (capture_us - start[0]) / 1e6 / speed -
+                         time.time())
+                if delay > 0:
+                    time.sleep(delay)
+            handler(capture_us, frame)
+
+
+class CaptureProcess(multiprocessing.Process):
+    """Captures the probe requests of one interface and puts (source,
+    capture_us, frame, packets) tuples into a queue shared with the other
+    capture processes. packets is the number of frames captured since the
+    last tuple, which is also sent with frame None at least every second while
+    no probe requests are captured. (source, None, None, packets) marks the
+    end of the capture.
+
+    Keyword arguments:
+    capture -- capture engine: scapy or raw
+    schedule -- channel hop schedule (see parse_hop_schedule)
+    offset -- first entry of the schedule, so that several interfaces
+              listen on different channels
+    replay_speed -- speed of replay:<file> interfaces (see replay)
+    """
+
+    def __init__(self, source, interface, queue, capture='scapy',
+                 schedule=None, offset=0, replay_speed=1.0):
+        super(CaptureProcess, self).__init__()
+        self.daemon = True
+        self.source = source
+        self.interface = interface
+        self.queue = queue
+        self.capture = capture
+        self.schedule = schedule
+        self.offset = offset
+        self.replay_speed = replay_speed
+        self._packets = 0
+        self._reported = time.time()
+
+    def run(self):
+        # the parent process stops the capture processes:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        hopper = None
+        if self.schedule and not is_replay(self.interface):
+            hopper = ChannelHopper(self.interface, self.schedule, self.offset)
+            hopper.start()
+        try:
+            self._capture()
+        except Exception as e:
+            log.error("Capture on {} failed: {}".format(self.interface, e))
+        finally:
+            if hopper:
+                hopper.stop()
+            self.queue.put((self.source, None, None, self._packets))
+
+    def _capture(self):
+        if is_replay(self.interface):
+            replay(self.interface[len(REPLAY_PREFIX):], self._put,
+                   self.replay_speed)
+        elif self.capture == 'raw':
+            dot11.capture(self.interface, lambda frame: self._put(
+                _epoch_us(datetime.datetime.now()), frame))
+        else:
+            from scapy.all import sniff as scapy_sniff
+            from scapy.all import conf as scapy_conf
+            # each process has its own scapy configuration:
+            scapy_conf.iface = self.interface
+            scapy_sniff(prn=lambda packet: self._put(
+                _epoch_us(datetime.datetime.now()),
+                getattr(packet, 'original', None) or str(packet)),
+                filter='type mgt subtype probe-req', store=0)
+
+    def _put(self, capture_us, frame):
+        self._packets += 1
+        if dot11.is_probe_request(frame):
+            self.queue.put((self.source, capture_us, frame, self._packets))
+        elif time.time() - self._reported >= 1.0:
+            self.queue.put((self.source, capture_us, None, self._packets))
+        else:
+            return
+        self._packets = 0
+        self._reported = time.time()
+
+
+class StreamMerger(object):
+    """Merges the time ordered streams of several sources into one stream in
+    timestamp order.
+
+    An item is released as soon as every source has either passed its
+    timestamp, ended, or been silent for max_delay seconds. Items of sources
+    which lag behind by more than max_delay may therefore be released out of
+    order.
+    """
+
+    def __init__(self, sources, max_delay=1.0):
+        self.max_delay = max_delay
+        now = time.time()
+        # last timestamp and last arrival time of each running source:
+        self.latest = dict((source, None) for source in sources)
+        self.arrived = dict((source, now) for source in sources)
+        self._heap = []
+        self._count = 0
+
+    def put(self, source, capture_us, item):
+        # the counter keeps items with equal timestamps in arrival order:
+        heapq.heappush(self._heap, (capture_us, self._count, item))
+        self._count += 1
+        if source in self.latest:
+            self.latest[source] = capture_us
+            self.arrived[source] = time.time()
+
+    def end(self, source):
+        self.latest.pop(source, None)
+        self.arrived.pop(source, None)
+
+    def running(self):
+        return bool(self.latest or self._heap)
+
+    def pop(self):
+        """Remove and return the (capture_us, item) tuples, which can be
+        released in order."""
+        now = time.time()
+        waiting = [capture_us for source, capture_us in self.latest.items()
+                   if now - self.arrived[source] < self.max_delay]
+        if None in waiting:
+            return []
+        limit = min(waiting) if waiting else None
+        released = []
+        while self._heap and (limit is None or self._heap[0][0] <= limit):
+            capture_us, count, item = heapq.heappop(self._heap)
+            released.append((capture_us, item))
+        return released
+
+
+def merge_captures(processes, queue, handler, max_delay=1.0, counter=None):
+    """Pass the frames of the capture processes to handler(capture_us, frame)
+    in timestamp order, until all processes have ended.
+
+    Keyword arguments:
+    counter -- function, which is called with the number of frames captured
+               by the processes
+    """
+    merger = StreamMerger([p.source for p in processes], max_delay)
+    while merger.running():
+        try:
+            source, capture_us, frame, packets = queue.get(
+                timeout=max_delay / 4.0)
+        except Empty:
+            for process in processes:
+                if process.source in merger.latest and not process.is_alive():
+                    log.error("Capture on {} stopped unexpectedly".format(
+                        process.interface))
+                    merger.end(process.source)
+        else:
+            if counter and packets:
+                counter(packets)
+            if capture_us is None:
+                merger.end(source)
+            elif frame is not None:
+                merger.put(source, capture_us, frame)
+        for capture_us, frame in merger.pop():
+            handler(capture_us, frame)
@@ -0,0 +1,166 @@
+from collections import OrderedDict, deque
+import logging
+import time
+from threading import Event, RLock, Thread
+
+from wifitracker.tracker import CoalescedRequest
+
+log = logging.getLogger(__name__)
+
+
+class Coalescer(object):
+    """Collapses the repeated requests of a device for the same SSID into one
+    CoalescedRequest, before they are added to the tracker.
+
+    A burst collects the requests of a (MAC, SSID) pair captured within
+    window seconds after its first request. The pending bursts are kept in a
+    queue in the order of their first request, which works as a time wheel:
+    bursts are only passed to emit from the head of the queue, single
+    requests unchanged, so the requests are emitted in the order of their
+    first capture timestamp. The head is emitted as soon as a request
+    captured window seconds after its first request has been added, or it
+    has been pending for window seconds, e.g. if no further requests arrive.
+    If more than max_entries bursts are pending, the head is emitted early,
+    so memory stays bounded.
+
+    Keyword arguments:
+    emit -- function, which is called with each request or burst
+    window -- time window of a burst in seconds
+    max_entries -- maximum number of pending bursts
+    """
+
+    def __init__(self, emit, window=1.0, max_entries=100000):
+        self.emit = emit
+        self.window = window
+        self.window_us = int(window * 1000000)
+        self.max_entries = max_entries
+        # counters:
+        self.requests = 0
+        self.emitted = 0
+        # [request, arrival time, RSSi sum, RSSi count, key] of the pending
+        # bursts in the order of their first request:
+        self._bursts = deque()
+        # (MAC, SSID) -> burst, which further requests can be merged into:
+        self._open = {}
+        # latest capture timestamp of the added requests:
+        self._latest_us = None
+        self._lock = RLock()
+        self._timer = None
+
+    def add(self, request):
+        with self._lock:
+            if self._timer is None:
+                self._timer = _ExpireTimer(self)
+                self._timer.start()
+            self.requests += 1
+            capture_us = request.capture_us
+            if capture_us is not None and (self._latest_us is None or
+                                           capture_us > self._latest_us):
+                self._latest_us = capture_us
+            self.expire()
+            key = (request.source_mac, request.target_ssid)
+            burst = self._open.pop(key, None)
+            if burst is not None:
+                first_us = burst[0].capture_us
+                if (capture_us is not None and
+                        0 <= capture_us - first_us < self.window_us):
+                    self._merge(burst, request)
+                    self._open[key] = burst
+                    return
+                # the burst is complete, but is emitted from the head only
+            signal = request.signal_strength
+            burst = [request, time.time(),
+                     signal if signal is not None else 0,
+                     1 if signal is not None else 0, key]
+            self._bursts.append(burst)
+            if capture_us is not None:
+                # requests without timestamp are never merged
+                self._open[key] = burst
+            if len(self._bursts) > self.max_entries:
+                self._emit_head()
+
+    def _merge(self, burst, request):
+        coalesced = burst[0]
+        if not isinstance(coalesced, CoalescedRequest):
+            signal = coalesced.signal_strength
+            coalesced = burst[0] = CoalescedRequest.from_us(
+                coalesced.source_mac, coalesced.capture_us,
+                coalesced.target_ssid, signal, signal_min=signal,
+                signal_max=signal)
+        coalesced.count += 1
+        if coalesced.last_us < request.capture_us:
+            coalesced.last_us = request.capture_us
+        signal = request.signal_strength
+        if signal is not None:
+            burst[2] += signal
+            burst[3] += 1
+            if coalesced.signal_min is None or signal < coalesced.signal_min:
+                coalesced.signal_min = signal
+            if coalesced.signal_max is None or coalesced.signal_max < signal:
+                coalesced.signal_max = signal
+
+    def _emit_head(self):
+        burst = self._bursts.popleft()
+        request, arrival, signal_sum, signal_count, key = burst
+        if self._open.get(key) is burst:
+            del self._open[key]
+        if request.count > 1 and signal_count:
+            request.signal_strength = int(round(float(signal_sum) /
+                                                signal_count))
+        self.emitted += 1
+        try:
+            self.emit(request)
+        except Exception as e:
+            log.error("Unable to emit coalesced request: {}".format(e))
+
+    def _complete(self, burst, deadline):
+        """Tell whether no more requests can be merged into a burst."""
+        if self._open.get(burst[4]) is not burst or burst[1] <= deadline:
+            return True
+        return self._latest_us - burst[0].capture_us >= self.window_us
+
+    def expire(self):
+        """Emit the complete bursts at the head of the queue."""
+        with self._lock:
+            deadline = time.time() - self.window
+            while self._bursts and self._complete(self._bursts[0], deadline):
+                self._emit_head()
+
+    def flush(self):
+        """Emit all pending bursts."""
+        with self._lock:
+            while self._bursts:
+                self._emit_head()
+
+    def close(self):
+        """Stop the expire timer and emit all pending bursts."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.stop()
+                self._timer = None
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return OrderedDict([('requests', self.requests),
+                                ('emitted', self.emitted),
+                                ('pending', len(self._bursts))])
+
+
+class _ExpireTimer(Thread):
+    """Helper thread which emits expired bursts of a Coalescer, even if no
+    further requests are added."""
+
+    def __init__(self, coalescer):
+        super(_ExpireTimer, self).__init__()
+        self.setDaemon(True)
+        self.coalescer = coalescer
+        self._stopped = Event()
+
+    def run(self):
+        interval = self.coalescer.window / 2.0
+        while not self._stopped.wait(interval):
+            self.coalescer.expire()
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,121 @@
+import binascii
+import logging
+import socket
+import struct
+
+from wifitracker.tracker import ProbeRequest
+
+log = logging.getLogger(__name__)
+
+RADIOTAP = struct.Struct('<BBHI')
+PRESENT = struct.Struct('<I')
+SIGNAL = struct.Struct('<b')
+PRESENT_EXT = 1 << 31
+# (alignment, size) of the radiotap fields up to the dBm antenna signal:
+# TSFT, flags, rate, channel, FHSS, dBm antenna signal
+RADIOTAP_FIELDS = [(8, 8), (1, 1), (1, 1), (2, 4), (1, 2), (1, 1)]
+FLAGS_FIELD = 1
+SIGNAL_FIELD = 5
+FLAG_FCS = 0x10
+# first byte of the frame control field: version 0, management, probe request
+PROBE_REQUEST = '\x40'
+DOT11_HEADER_SIZE = 24
+SSID_ELEMENT = 0
+ETH_P_ALL = 0x0003
+
+
+def parse_radiotap(frame):
+    """Parse the radiotap header of a captured frame.
+
+    Returns a tuple of the length of the header, the dBm antenna signal (None
+    if it is not present) and the flags.
+    """
+    version, pad, length, present = RADIOTAP.unpack_from(frame)
+    offset = RADIOTAP.size
+    extended = present
+    while extended & PRESENT_EXT:
+        # skip extended presence bitmasks
+        extended = PRESENT.unpack_from(frame, offset)[0]
+        offset += PRESENT.size
+    signal = None
+    flags = 0
+    for bit, (align, size) in enumerate(RADIOTAP_FIELDS):
+        if not present & (1 << bit):
+            continue
+        offset = (offset + align - 1) & ~(align - 1)
+        if bit == FLAGS_FIELD:
+            flags = ord(frame[offset])
+        elif bit == SIGNAL_FIELD:
+            signal = SIGNAL.unpack_from(frame, offset)[0]
+        offset += size
+    return length, signal, flags
+
+
+def is_probe_request(frame):
+    """Check the frame type of a frame with radiotap header, without parsing
+    the radiotap header."""
+    try:
+        length = RADIOTAP.unpack_from(frame)[2]
+    except struct.error:
+        return False
+    return frame[length:length + 1] == PROBE_REQUEST
+
+
+def parse_probe_request(frame, capture_dts):
+    """Create a ProbeRequest from a captured frame with radiotap header.
+    Returns None if the frame is no probe request or is truncated.
+
+    Instead of dissecting the whole frame, only the radiotap fields up to the
+    antenna signal, the transmitter address and the SSID element are read.
+    """
+    try:
+        length, signal, flags = parse_radiotap(frame)
+    except (struct.error, IndexError):
+        return None
+    end = len(frame) - 4 if flags & FLAG_FCS else len(frame)
+    return parse_dot11_probe_request(frame, capture_dts, length, end, signal)
+
+
+def parse_dot11_probe_request(frame, capture_dts, offset=0, end=None,
+                              signal=None):
+    """Create a ProbeRequest from the 802.11 frame beginning at offset.
+    Returns None if the frame is no probe request or is truncated.
+
+    end -- position after the last byte of the frame body (before the FCS)
+    signal -- RSSi of the frame
+    """
+    end = len(frame) if end is None else end
+    if end < offset + DOT11_HEADER_SIZE or frame[offset] != PROBE_REQUEST:
+        return None
+    mac = _mac(frame[offset + 10:offset + 16])
+    ssid = None
+    offset += DOT11_HEADER_SIZE
+    while offset + 2 <= end:
+        element_id = ord(frame[offset])
+        element_size = ord(frame[offset + 1])
+        if element_id == SSID_ELEMENT:
+            ssid = frame[offset + 2:min(offset + 2 + element_size, end)]
+            break
+        offset += 2 + element_size
+    return ProbeRequest(mac, capture_dts, target_ssid=ssid if ssid else None,
+                        signal_strength=signal)
+
+
+def _mac(address):
+    mac = binascii.hexlify(address)
+    return ':'.join([mac[i:i + 2] for i in xrange(0, 12, 2)])
+
+
+def capture(interface, handler, snaplen=65535):
+    """Receive raw frames of an interface in monitor mode through an
+    AF_PACKET socket and pass each frame to the handler. This requires root
+    privileges.
+    """
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW,
+                         socket.htons(ETH_P_ALL))
+    try:
+        sock.bind((interface, ETH_P_ALL))
+        while True:
+            handler(sock.recv(snaplen))
+    finally:
+        sock.close()
@@ -0,0 +1,110 @@
+import logging
+import multiprocessing
+
+from wifitracker import dot11
+from wifitracker.pcap import (LINKTYPE_IEEE802_11,
+                              LINKTYPE_IEEE802_11_RADIOTAP, read_pcap)
+from wifitracker.tracker import ProbeRequest
+
+log = logging.getLogger(__name__)
+
+# queue of a worker process, set by _init_worker:
+_queue = None
+
+
+def read_probe_requests(filename):
+    """Yield the probe requests captured in a pcap or pcapng file. The capture
+    timestamps of the records are used as capture_dts."""
+    with open(filename, 'rb') as file:
+        for capture_dts, linktype, frame in read_pcap(file):
+            if linktype == LINKTYPE_IEEE802_11_RADIOTAP:
+                request = dot11.parse_probe_request(frame, capture_dts)
+            elif linktype == LINKTYPE_IEEE802_11:
+                request = dot11.parse_dot11_probe_request(frame, capture_dts)
+            else:
+                raise ValueError("Unsupported link type {} in {}".format(
+                    linktype, filename))
+            if request:
+                yield request
+
+
+def _batches(filename, batch_size):
+    batch = []
+    for request in read_probe_requests(filename):
+        batch.append(request)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_files(tracker, filenames, jobs=1, batch_size=10000):
+    """Add the probe requests of pcap or pcapng files to the tracker.
+
+    With more than one job, the files are parsed by a pool of processes. The
+    batches of requests of different files are added in the order in which
+    they are parsed.
+
+    Returns the number of imported requests.
+    """
+    count = 0
+    if jobs <= 1 or len(filenames) <= 1:
+        for filename in filenames:
+            try:
+                for batch in _batches(filename, batch_size):
+                    tracker.add_requests(batch)
+                    count += len(batch)
+            except (IOError, ValueError) as e:
+                log.error("Unable to import {}: {}".format(filename, e))
+                continue
+            log.info("imported {}".format(filename))
+        tracker.flush()
+        return count
+    # the queue is bounded, so that parsed requests do not pile up in memory:
+    queue = multiprocessing.Queue(jobs * 4)
+    pool = multiprocessing.Pool(min(jobs, len(filenames)), _init_worker,
+                                (queue,))
+    try:
+        pool.map_async(_parse_file, [(filename, batch_size)
+                                     for filename in filenames])
+        pending = len(filenames)
+        while pending:
+            filename, batch = queue.get()
+            if isinstance(batch, list):
+                tracker.add_requests([ProbeRequest(*r) for r in batch])
+                count += len(batch)
+                continue
+            pending -= 1
+            if batch:
+                log.error("Unable to import {}: {}".format(filename, batch))
+            else:
+                log.info("imported {}".format(filename))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    tracker.flush()
+    return count
+
+
+def _init_worker(queue):
+    global _queue
+    _queue = queue
+
+
+def _parse_file(args):
+    """Parse a file in a worker process and pass batches of request tuples to
+    the queue. The end of the file is marked by None, or an error message."""
+    filename, batch_size = args
+    try:
+        for batch in _batches(filename, batch_size):
+            _queue.put((filename, [(r.source_mac, r.capture_dts,
+                                    r.target_ssid, r.signal_strength)
+                                   for r in batch]))
+    except Exception as e:
+        _queue.put((filename, str(e) or repr(e)))
+        return
+    _queue.put((filename, None))
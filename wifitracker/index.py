@@ -0,0 +1,124 @@
+import datetime
+import logging
+import sqlite3
+
+log = logging.getLogger(__name__)
+
+FIELDS = ('source_mac', 'target_ssid')
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class RequestIndex(object):
+    """Secondary index over the request file.
+
+    The index maps device MACs and SSIDs to the byte offsets of the matching
+    requests in the request file. It is stored in a SQLite database, which
+    allows the sniffer to update the index while other processes read it.
+    Besides the offsets, the index stores the position up to which the request
+    file has been indexed (end), so that it can be updated incrementally.
+
+    The index also samples every sample_rate-th request: it stores its offset
+    together with the latest capture_us of all requests before it. This
+    sparse timestamp index tells from where a query for requests captured
+    since a given timestamp has to read the request file (see seek).
+    """
+
+    def __init__(self, filename, sample_rate=1000):
+        self.filename = filename
+        self.sample_rate = sample_rate
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            # the index is updated by whichever thread flushes the writer:
+            self._db = sqlite3.connect(self.filename, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS postings '
+                             '(field TEXT, key TEXT, offset INTEGER)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS postings_key '
+                             'ON postings (field, key, offset)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS time_samples '
+                             '(offset INTEGER PRIMARY KEY, max_us INTEGER)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta '
+                             '(name TEXT PRIMARY KEY, value)')
+            self._db.commit()
+        return self._db
+
+    def _meta(self, name, default=None):
+        row = self._connect().execute(
+            'SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else default
+
+    def end(self):
+        """Position in the request file up to which requests are indexed."""
+        return self._meta('end', 0)
+
+    def add(self, entries, end, escape_ssid=None):
+        """Add index entries and set the indexed end of the request file.
+
+        Keyword arguments:
+        entries -- iterable of (offset, request) tuples
+        end -- position in the request file after the last indexed request
+        escape_ssid -- function converting the SSIDs of the requests to the
+                       keys under which they are read from the request file
+        """
+        rows = []
+        samples = []
+        count = self._meta('count', 0)
+        max_us = self._meta('max_us')
+        for offset, request in entries:
+            rows.append(('source_mac', request.source_mac, offset))
+            ssid = request.target_ssid
+            if ssid:
+                if escape_ssid:
+                    ssid = escape_ssid(ssid)
+                rows.append(('target_ssid', ssid, offset))
+            if count % self.sample_rate == 0 and max_us is not None:
+                samples.append((offset, max_us))
+            count += 1
+            capture_us = request.capture_us
+            if capture_us is not None and (max_us is None or
+                                           max_us < capture_us):
+                max_us = capture_us
+        db = self._connect()
+        with db:
+            db.executemany('INSERT INTO postings VALUES (?, ?, ?)', rows)
+            db.executemany('INSERT OR REPLACE INTO time_samples '
+                           'VALUES (?, ?)', samples)
+            db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                           [('end', end), ('count', count),
+                            ('max_us', max_us)])
+        log.debug("indexed {} requests up to {}".format(len(rows), end))
+
+    def lookup(self, field, key):
+        """Return the sorted offsets of all requests with the given value of
+        field (source_mac or target_ssid)."""
+        if field not in FIELDS:
+            raise ValueError("Field not indexed: {}".format(field))
+        cursor = self._connect().execute(
+            'SELECT offset FROM postings WHERE field = ? AND key = ? '
+            'ORDER BY offset', (field, key))
+        return [row[0] for row in cursor]
+
+    def seek(self, since):
+        """Return a position in the request file, before which all requests
+        were captured before since."""
+        delta = since - EPOCH
+        since_us = (delta.days * 86400 + delta.seconds) * 1000000 + \
+            delta.microseconds
+        row = self._connect().execute(
+            'SELECT MAX(offset) FROM time_samples WHERE max_us < ?',
+            (since_us,)).fetchone()
+        return row[0] or 0
+
+    def clear(self):
+        """Remove all entries from the index."""
+        db = self._connect()
+        with db:
+            db.execute('DELETE FROM postings')
+            db.execute('DELETE FROM time_samples')
+            db.execute('DELETE FROM meta')
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,202 @@
+from collections import OrderedDict
+import json
+import logging
+import os
+import socket
+from threading import Event, Lock, Thread
+
+from wifitracker.tracker import Snapshot
+
+log = logging.getLogger(__name__)
+
+QUERIES = ('ping', 'devices', 'device', 'stations', 'station', 'stats')
+MAX_REQUEST_SIZE = 64 * 1024
+
+
+class LiveAggregate(object):
+    """Devices and stations of a running sniffer, kept in memory and updated
+    with each captured request.
+
+    The aggregate starts from the snapshot of all requests stored before the
+    sniffer was started. Requests added to the storage by other processes
+    (e.g. the import command) while the sniffer is running are not included.
+
+    Keyword arguments:
+    escape_ssid -- function converting captured SSIDs to the form in which
+                   they are read from the storage (see the escape_ssid method
+                   of the storages), so that the aggregate matches a scan
+    """
+
+    def __init__(self, snapshot=None, escape_ssid=None):
+        self.snapshot = snapshot if snapshot else Snapshot()
+        self.escape_ssid = escape_ssid
+        self._lock = Lock()
+
+    def add_request(self, request):
+        with self._lock:
+            self.snapshot.add_request(request, self.escape_ssid)
+
+    def query(self, query, id=None):
+        """Return a snapshot dump (see Snapshot.to_dump) with the devices or
+        stations selected by the query. Single devices and stations are
+        selected by id, the dump is empty if they are unknown.
+        """
+        devices = {}
+        stations = {}
+        with self._lock:
+            snapshot = self.snapshot
+            if query == 'devices':
+                devices = snapshot.devices
+            elif query == 'device' and id in snapshot.devices:
+                devices = {id: snapshot.devices[id]}
+            elif query == 'stations':
+                stations = snapshot.stations
+            elif query == 'station' and id in snapshot.stations:
+                stations = {id: snapshot.stations[id]}
+            return Snapshot(snapshot.offset, snapshot.max_dts, devices,
+                            stations).to_dump()
+
+
+class LiveServer(Thread):
+    """Answers queries of the live aggregate on a Unix domain socket.
+
+    The protocol is one request and one response per connection, each a JSON
+    object on a single line:
+
+        {"query": "device", "id": "00:11:22:33:44:55"}
+        {"ok": true, "result": {...}}
+
+    query is one of QUERIES, id selects a single device or station. The
+    result of the stats query is returned by the stats function. Errors are
+    answered with {"ok": false, "error": "..."}.
+    """
+
+    def __init__(self, filename, aggregate, stats=None):
+        super(LiveServer, self).__init__()
+        self.setDaemon(True)
+        self.filename = filename
+        self.aggregate = aggregate
+        self.stats = stats
+        self._stopped = Event()
+        if os.path.exists(filename):
+            # left behind by a sniffer which has been killed:
+            os.remove(filename)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(filename)
+        self._socket.listen(16)
+        # wake up regularly to check whether the server has been stopped:
+        self._socket.settimeout(0.5)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                connection = self._socket.accept()[0]
+            except socket.timeout:
+                continue
+            except socket.error as e:
+                if not self._stopped.is_set():
+                    log.error("Live server failed: {}".format(e))
+                break
+            # the JSON of all devices may take a while, don't block others:
+            thread = Thread(target=self._handle, args=(connection,))
+            thread.setDaemon(True)
+            thread.start()
+
+    def _handle(self, connection):
+        try:
+            connection.settimeout(5.0)
+            try:
+                request = json.loads(_read_line(connection))
+                response = {'ok': True,
+                            'result': self.answer(request['query'],
+                                                  request.get('id'))}
+                data = json.dumps(response, separators=(',', ':'))
+            except (ValueError, KeyError, TypeError) as e:
+                log.warn("Live query failed: {!r}".format(e))
+                data = json.dumps({'ok': False, 'error': str(e) or repr(e)},
+                                  separators=(',', ':'))
+            connection.sendall(data + '\n')
+        except socket.error as e:
+            log.warn("Unable to answer live query: {}".format(e))
+        finally:
+            connection.close()
+
+    def answer(self, query, id=None):
+        if query not in QUERIES:
+            raise ValueError("Unknown query: {}".format(query))
+        if query == 'ping':
+            return None
+        if query == 'stats':
+            if not self.stats:
+                raise ValueError("No stats available")
+            return self.stats()
+        return self.aggregate.query(query, id)
+
+    def stop(self):
+        """Stop accepting queries and remove the socket file."""
+        self._stopped.set()
+        self.join()
+        self._socket.close()
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+
+def _read_line(connection):
+    data = ''
+    while '\n' not in data:
+        chunk = connection.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > MAX_REQUEST_SIZE:
+            raise ValueError("Request too large")
+    return data.split('\n', 1)[0]
+
+
+def query(filename, query, id=None, timeout=5.0):
+    """Query the live aggregate of a running sniffer.
+
+    Returns the Snapshot with the selected devices or stations, or None if no
+    sniffer is listening on the socket or the query failed.
+    """
+    result = request(filename, query, id, timeout)
+    if result is None:
+        return None
+    return Snapshot.from_dump(result)
+
+
+def stats(filename, timeout=5.0):
+    """Return the metrics and stats of a running sniffer, or None if no
+    sniffer is listening on the socket."""
+    return request(filename, 'stats', timeout=timeout)
+
+
+def request(filename, query, id=None, timeout=5.0):
+    """Send a query to the live server and return its decoded result. None
+    is returned if no sniffer is listening on the socket or the query
+    failed."""
+    if not os.path.exists(filename):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(filename)
+        client.sendall(json.dumps({'query': query, 'id': id}) + '\n')
+        data = []
+        while True:
+            chunk = client.recv(256 * 1024)
+            if not chunk:
+                break
+            data.append(chunk)
+        response = json.loads(''.join(data), object_pairs_hook=OrderedDict)
+    except (socket.error, ValueError) as e:
+        log.debug("No live sniffer at {}: {}".format(filename, e))
+        return None
+    finally:
+        client.close()
+    if not response.get('ok'):
+        log.warn("Live query failed: {}".format(response.get('error')))
+        return None
+    return response['result']
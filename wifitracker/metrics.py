@@ -0,0 +1,203 @@
+import bisect
+from collections import OrderedDict
+import logging
+import os
+import time
+from threading import Event, Lock, Thread
+
+log = logging.getLogger(__name__)
+
+# upper bounds of the latency buckets in seconds:
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01,
+                   0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+
+class Counter(object):
+
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dump(self):
+        return self.value
+
+    def samples(self):
+        return [(self.name, '', self.value)]
+
+
+class Histogram(object):
+    """Counts observed values (e.g. latencies in seconds) in buckets with the
+    given upper bounds, and keeps their sum."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def since(self, start):
+        """Observe the seconds elapsed since start (a time.time() value)."""
+        self.observe(time.time() - start)
+
+    def dump(self):
+        with self._lock:
+            counts = list(self.counts)
+            count, sum = self.count, self.sum
+        return OrderedDict([('count', count),
+                            ('sum', sum),
+                            ('mean', sum / count if count else None),
+                            ('buckets', OrderedDict(
+                                zip([str(b) for b in self.buckets] + ['+Inf'],
+                                    _cumulative(counts))))])
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            count, sum = self.count, self.sum
+        bounds = [repr(b) for b in self.buckets] + ['+Inf']
+        samples = [(self.name + '_bucket', '{{le="{}"}}'.format(bound), n)
+                   for bound, n in zip(bounds, _cumulative(counts))]
+        return samples + [(self.name + '_sum', '', sum),
+                          (self.name + '_count', '', count)]
+
+
+def _cumulative(counts):
+    total = 0
+    result = []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+class Registry(object):
+    """The metrics of a process by name.
+
+    Modules register their counters and latency histograms in REGISTRY when
+    they are imported. The metrics of a running sniffer are served by the
+    stats query of its live server (see wifitracker.live) and can be written
+    to a Prometheus text file.
+    """
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self._lock = Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help):
+        return self._register(Counter(name, help))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, buckets))
+
+    def dump(self):
+        """Return the values of all metrics as JSON serializable dict."""
+        return OrderedDict((name, metric.dump())
+                           for name, metric in self.metrics.items())
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help):
+    """Register a counter in REGISTRY, or return the registered one."""
+    return REGISTRY.counter(name, help)
+
+
+def histogram(name, help, buckets=LATENCY_BUCKETS):
+    """Register a histogram in REGISTRY, or return the registered one."""
+    return REGISTRY.histogram(name, help, buckets)
+
+
+def prometheus_from_dump(dump, registry=REGISTRY):
+    """Format a dump of a registry (e.g. received from a running sniffer) in
+    the Prometheus text format. Help texts and types are taken from the
+    metrics of the same name in the local registry."""
+    lines = []
+    for name, value in dump.items():
+        metric = registry.metrics.get(name)
+        if metric is not None:
+            lines.append('# HELP {} {}'.format(name, metric.help))
+            lines.append('# TYPE {} {}'.format(name, metric.type))
+        if isinstance(value, dict):
+            buckets = sorted(value['buckets'].items(),
+                             key=lambda bucket: float(bucket[0]))
+            for bound, count in buckets:
+                bound = bound if bound == '+Inf' else repr(float(bound))
+                lines.append('{}_bucket{{le="{}"}} {}'.format(name, bound,
+                                                              count))
+            lines.append('{}_sum {}'.format(name, value['sum']))
+            lines.append('{}_count {}'.format(name, value['count']))
+        else:
+            lines.append('{} {}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(filename, registry=REGISTRY):
+    """Write the metrics to a text file, e.g. for the textfile collector of
+    the Prometheus node exporter. The file is replaced atomically."""
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as file:
+        file.write(registry.prometheus())
+    os.rename(tmp_filename, filename)
+
+
+class PrometheusWriter(Thread):
+    """Helper thread which writes the metrics to a text file every interval
+    seconds, and once more when it is stopped."""
+
+    def __init__(self, filename, interval=10.0, registry=REGISTRY):
+        super(PrometheusWriter, self).__init__()
+        self.setDaemon(True)
+        self.filename = filename
+        self.interval = interval
+        self.registry = registry
+        self._stopped = Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            write_prometheus(self.filename, self.registry)
+        except (IOError, OSError) as e:
+            log.warn("Unable to write metrics: {}".format(e))
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.write()
@@ -0,0 +1,395 @@
+from collections import OrderedDict
+import csv
+import logging
+import os.path
+import random
+import re
+import sqlite3
+import time
+from threading import RLock, Thread
+try:
+    from queue import Empty, Queue  # try python3
+    from urllib.parse import urlparse
+except ImportError:
+    from Queue import Empty, Queue
+    from urlparse import urlparse
+
+import requests
+
+log = logging.getLogger(__name__)
+
+# IEEE registries of MAC address blocks (MA-L, MA-M and MA-S):
+REGISTRIES = [('oui.csv', 'https://standards-oui.ieee.org/oui/oui.csv'),
+              ('mam.csv', 'https://standards-oui.ieee.org/oui28/mam.csv'),
+              ('oui36.csv', 'https://standards-oui.ieee.org/oui36/oui36.csv')]
+
+COUNTRY = re.compile(r'\b([A-Z]{2})\b')
+
+LOOKUP_URL = 'https://www.macvendorlookup.com/api/v2/{}'
+
+
+class OuiDatabase(object):
+    """Offline vendor lookup based on the IEEE registries of MAC address
+    blocks.
+
+    The assignments are kept in one dict per prefix length (24, 28 and 36
+    bits), which maps the prefix to the number of the vendor. A lookup tries
+    the longest prefix first, since the smaller MA-M and MA-S blocks are
+    assigned from within MA-L blocks.
+    """
+
+    def __init__(self):
+        self.prefixes = {}
+        self.vendors = []
+        self._vendor_numbers = {}
+
+    def __len__(self):
+        return sum(len(prefixes) for prefixes in self.prefixes.values())
+
+    def add(self, assignment, company, country=None):
+        """Add an assigned block of MAC addresses.
+
+        assignment -- hex digits of the prefix (e.g. '002272')
+        """
+        vendor = (company, country)
+        if vendor not in self._vendor_numbers:
+            self._vendor_numbers[vendor] = len(self.vendors)
+            self.vendors.append(vendor)
+        bits = len(assignment) * 4
+        self.prefixes.setdefault(bits, {})[int(assignment, 16)] = \
+            self._vendor_numbers[vendor]
+
+    def load(self, filename):
+        """Add all assignments of a registry file in the IEEE CSV format:
+        Registry,Assignment,Organization Name,Organization Address
+        """
+        count = 0
+        with open(filename, 'rb') as file:
+            reader = csv.reader(file)
+            next(reader, None)  # skip the header
+            for row in reader:
+                try:
+                    registry, assignment, company, address = row[:4]
+                    self.add(assignment.strip(), company.strip(),
+                             _country(address))
+                    count += 1
+                except ValueError:
+                    log.warn("Invalid assignment in {}: {}".format(filename,
+                                                                   row))
+        log.debug("loaded {} assignments from {}".format(count, filename))
+        return count
+
+    def lookup(self, device_mac):
+        """Return the vendor of a MAC address as dict of company and country,
+        or None if the address is not in a known block."""
+        try:
+            mac = int(device_mac.replace(':', '').replace('-', ''), 16)
+        except ValueError:
+            return None
+        for bits in sorted(self.prefixes, reverse=True):
+            vendor_no = self.prefixes[bits].get(mac >> (48 - bits))
+            if vendor_no is not None:
+                company, country = self.vendors[vendor_no]
+                return {'company': company, 'country': country}
+        return None
+
+
+class VendorCache(object):
+    """Cache of online vendor lookups, keyed by the OUI (the first three
+    octets of the MAC), since many devices share one OUI.
+
+    The entries are stored in a SQLite database and expire after ttl seconds.
+    Failed lookups are cached as negative entries, which expire after
+    negative_ttl seconds, doubled for each consecutive failure up to
+    max_backoff seconds. Recently used entries are also kept in memory, up to
+    max_entries entries.
+    """
+
+    def __init__(self, filename, ttl=30 * 24 * 3600, negative_ttl=3600,
+                 max_backoff=7 * 24 * 3600, max_entries=10000):
+        self.filename = filename
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_backoff = max_backoff
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = RLock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            # vendors are looked up by many threads:
+            self._db = sqlite3.connect(self.filename, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS vendors '
+                             '(oui TEXT PRIMARY KEY, company TEXT, '
+                             'country TEXT, expires REAL, failures INTEGER)')
+            self._db.commit()
+        return self._db
+
+    def _load(self, oui):
+        """Return the (vendor, expires, failures) entry of an OUI."""
+        if oui in self._entries:
+            entry = self._entries.pop(oui)
+        else:
+            row = self._connect().execute(
+                'SELECT company, country, expires, failures FROM vendors '
+                'WHERE oui = ?', (oui,)).fetchone()
+            if row is None:
+                return None
+            company, country, expires, failures = row
+            vendor = None
+            if company is not None:
+                vendor = {'company': company, 'country': country}
+            entry = (vendor, expires, failures)
+        self._remember(oui, entry)
+        return entry
+
+    def _remember(self, oui, entry):
+        self._entries.pop(oui, None)
+        self._entries[oui] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _store(self, oui, vendor, expires, failures):
+        self._remember(oui, (vendor, expires, failures))
+        vendor = vendor if vendor else {}
+        db = self._connect()
+        with db:
+            db.execute('INSERT OR REPLACE INTO vendors VALUES (?, ?, ?, ?, ?)',
+                       (oui, vendor.get('company'), vendor.get('country'),
+                        expires, failures))
+
+    def get(self, device_mac, now=None):
+        """Return a tuple (cached, vendor). cached is False if the OUI of the
+        MAC has to be looked up, vendor is None for failed lookups."""
+        now = now if now else time.time()
+        with self._lock:
+            entry = self._load(get_oui(device_mac))
+            if entry is None or entry[1] <= now:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            return True, entry[0]
+
+    def put(self, device_mac, vendor, now=None):
+        """Cache the vendor of the OUI of a MAC."""
+        now = now if now else time.time()
+        with self._lock:
+            self._store(get_oui(device_mac), vendor, now + self.ttl, 0)
+
+    def fail(self, device_mac, now=None):
+        """Cache a failed lookup of the OUI of a MAC."""
+        now = now if now else time.time()
+        with self._lock:
+            key = get_oui(device_mac)
+            entry = self._load(key)
+            failures = entry[2] + 1 if entry and not entry[0] else 1
+            backoff = min(self.negative_ttl * 2 ** (failures - 1),
+                          self.max_backoff)
+            self._store(key, None, now + backoff, failures)
+
+    def stats(self):
+        """Return the counters of the cache."""
+        lookups = self.hits + self.misses
+        return OrderedDict([
+            ('hits', self.hits),
+            ('misses', self.misses),
+            ('hit_rate', float(self.hits) / lookups if lookups else 0.0)])
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class VendorResolver(object):
+    """Looks up the vendors of many MACs online, once per OUI.
+
+    The lookups are done by a bounded number of threads, which stop as soon
+    as there is nothing left to look up or the deadline has passed. Requests
+    to a host are spaced to at most rate requests per second. Failed requests
+    are retried after an exponential backoff with random jitter.
+
+    Keyword arguments:
+    url -- lookup URL with a placeholder for the MAC
+    concurrency -- maximum number of concurrent requests
+    rate -- maximum number of requests per second and host
+    retries -- number of retries of a failed request
+    backoff -- delay in seconds before the first retry
+    timeout -- timeout of a single request in seconds
+    deadline -- time limit of all lookups in seconds, vendors which have not
+                been looked up until then stay unknown
+    cache -- VendorCache, which is asked before and updated after lookups
+    """
+
+    def __init__(self, url=LOOKUP_URL, concurrency=10, rate=10.0, retries=3,
+                 backoff=0.5, timeout=10, deadline=60, cache=None,
+                 session=None):
+        self.url = url
+        self.concurrency = concurrency
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.deadline = deadline
+        self.cache = cache
+        self.session = session
+        # counters:
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+        self._lock = RLock()
+        self._next_request = {}
+
+    def resolve(self, device_macs):
+        """Look up the vendors of the MACs. Returns a dict, which maps each
+        MAC to its vendor (a dict of company and country) or None."""
+        macs = OrderedDict()
+        for device_mac in device_macs:
+            macs.setdefault(get_oui(device_mac), device_mac)
+        vendors = {}
+        pending = Queue()
+        for oui, device_mac in macs.items():
+            cached, vendor = self.cache.get(device_mac) if self.cache else \
+                (False, None)
+            if cached:
+                vendors[oui] = vendor
+            else:
+                pending.put((oui, device_mac))
+        if not pending.empty():
+            self._lookup_all(pending, vendors)
+        return dict((device_mac, vendors.get(get_oui(device_mac)))
+                    for device_mac in device_macs)
+
+    def _lookup_all(self, pending, vendors):
+        session = self.session if self.session else requests.Session()
+        # reuse one connection per thread:
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        deadline = time.time() + self.deadline
+        threads = []
+        for i in xrange(min(self.concurrency, pending.qsize())):
+            thread = Thread(target=self._work,
+                            args=(session, pending, vendors, deadline))
+            # a thread might still wait for a response after the deadline:
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
+        left = pending.qsize() + len([t for t in threads if t.is_alive()])
+        if left:
+            log.warn("Vendor lookup deadline exceeded, {} OUIs left.".format(
+                left))
+        if not self.session:
+            session.close()
+
+    def _work(self, session, pending, vendors, deadline):
+        while time.time() < deadline:
+            try:
+                oui, device_mac = pending.get_nowait()
+            except Empty:
+                return
+            vendor = self._lookup(session, device_mac, deadline)
+            with self._lock:
+                vendors[oui] = vendor
+
+    def _lookup(self, session, device_mac, deadline):
+        """Look up the vendor of one MAC, with retries. Unknown vendors and
+        failed lookups are cached as negative entries."""
+        url = self.url.format(device_mac)
+        for attempt in xrange(self.retries + 1):
+            if attempt:
+                with self._lock:
+                    self.retried += 1
+                delay = self.backoff * 2 ** (attempt - 1) * \
+                    random.uniform(0.5, 1.5)
+                if time.time() + delay >= deadline:
+                    break
+                time.sleep(delay)
+            self._throttle(url)
+            try:
+                response = session.get(url, timeout=max(
+                    0.1, min(self.timeout, deadline - time.time())))
+                with self._lock:
+                    self.requests += 1
+                if response.status_code == 429 or response.status_code >= 500:
+                    log.debug("Vendor lookup of {} failed: {}".format(
+                        device_mac, response.status_code))
+                    continue
+                if response.status_code != 200:
+                    # the vendor is unknown
+                    break
+                vendor = response.json()[0]
+                vendor = {'company': vendor['company'],
+                          'country': vendor['country']}
+                if self.cache:
+                    self.cache.put(device_mac, vendor)
+                return vendor
+            except Exception as e:
+                log.debug("Vendor lookup of {} failed: {}".format(device_mac,
+                                                                  e))
+        with self._lock:
+            self.failed += 1
+        log.warn("Unable to lookup vendor for: {}".format(device_mac))
+        if self.cache:
+            self.cache.fail(device_mac)
+        return None
+
+    def _throttle(self, url):
+        """Wait until the next request to the host of the URL is allowed."""
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.time()
+            next_request = max(now, self._next_request.get(host, now))
+            self._next_request[host] = next_request + 1.0 / self.rate
+        if next_request > now:
+            time.sleep(next_request - now)
+
+    def stats(self):
+        """Return the counters of the resolver."""
+        return OrderedDict([('requests', self.requests),
+                            ('retried', self.retried),
+                            ('failed', self.failed)])
+
+
+def get_oui(device_mac):
+    """Return the OUI of a MAC in the format 'xx:xx:xx'."""
+    return device_mac.lower().replace('-', ':')[:8]
+
+
+def _country(address):
+    """Extract the country code from the address of an assignment, which ends
+    with the country code and the postal code."""
+    codes = COUNTRY.findall(address)
+    return codes[-1] if codes else None
+
+
+def load_database(directory):
+    """Load all registry files found in the directory. Returns None if there
+    are none."""
+    database = OuiDatabase()
+    found = False
+    for name, url in REGISTRIES:
+        filename = os.path.join(directory, name)
+        if os.path.exists(filename):
+            database.load(filename)
+            found = True
+    return database if found else None
+
+
+def download(directory, session=None):
+    """Download the registry files from the IEEE to the directory."""
+    session = session if session else requests.Session()
+    for name, url in REGISTRIES:
+        response = session.get(url, timeout=60)
+        response.raise_for_status()
+        filename = os.path.join(directory, name)
+        with open(filename + '.tmp', 'wb') as file:
+            file.write(response.content)
+        os.rename(filename + '.tmp', filename)
+        log.info("downloaded {}".format(url))
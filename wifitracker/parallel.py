@@ -0,0 +1,80 @@
+import logging
+import multiprocessing
+
+from wifitracker.storage import open_storage
+from wifitracker.tracker import Snapshot, _filter_requests
+
+log = logging.getLogger(__name__)
+
+# storage of a worker process, opened by _init_worker:
+_storage = None
+
+
+def _init_worker(name, storage_dir, options):
+    global _storage
+    _storage = open_storage(name, storage_dir, **options)
+
+
+def _scan_range(args):
+    """Decode and aggregate the requests of one range of the storage.
+
+    Returns the devices and stations of the requests, and the position after
+    the last request of the range.
+    """
+    start, end, load_dts, since = args
+    snapshot = Snapshot(offset=start)
+    for entries, chunk_end in _storage.read_range(start, end):
+        requests = [request for offset, request in entries]
+        if load_dts:
+            requests = _filter_requests(requests, load_dts, since)
+        for request in requests:
+            snapshot.add_request(request)
+        snapshot.offset = chunk_end
+    return snapshot.devices, snapshot.stations, snapshot.offset
+
+
+def scan(storage, storage_dir, options, jobs, start=0, load_dts=None,
+         since=None, snapshot=None):
+    """Aggregate the requests written to the storage after the given position
+    in a pool of jobs processes.
+
+    The storage is split into ranges, which are decoded and aggregated by the
+    worker processes. The partial devices and stations are merged in the order
+    of the ranges, so the result equals a sequential scan. Only requests
+    captured before load_dts and not before since are considered, unless
+    load_dts is None.
+
+    Keyword arguments:
+    storage -- storage backend to scan
+    options -- dict of additional arguments of the storage backend
+    snapshot -- Snapshot to update, a new one is created if omitted
+
+    Returns the updated snapshot.
+    """
+    if snapshot is None:
+        snapshot = Snapshot(offset=start)
+    if not storage.exists():
+        return snapshot
+    # more ranges than processes even out ranges of different costs:
+    ranges = storage.split(start, jobs * 4)
+    if not ranges:
+        return snapshot
+    log.debug("scanning {} ranges with {} processes".format(len(ranges),
+                                                            jobs))
+    pool = multiprocessing.Pool(jobs, _init_worker,
+                                (storage.name, storage_dir, options))
+    try:
+        arguments = [(range_start, range_end, load_dts, since)
+                     for range_start, range_end in ranges]
+        results = pool.imap(_scan_range, arguments)
+        for devices, stations, end in results:
+            # merge also updates max_dts with the last seen devices:
+            snapshot.merge(devices, stations)
+            snapshot.offset = end
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return snapshot
@@ -0,0 +1,118 @@
+import datetime
+import logging
+import struct
+
+log = logging.getLogger(__name__)
+
+LINKTYPE_IEEE802_11 = 105
+LINKTYPE_IEEE802_11_RADIOTAP = 127
+# magic numbers of pcap files with microsecond and nanosecond timestamps:
+MAGIC_US = 0xa1b2c3d4
+MAGIC_NS = 0xa1b23c4d
+# pcapng block types:
+SECTION_HEADER_BLOCK = 0x0a0d0d0a
+INTERFACE_DESCRIPTION_BLOCK = 1
+ENHANCED_PACKET_BLOCK = 6
+BYTE_ORDER_MAGIC = 0x1a2b3c4d
+OPTION_TSRESOL = 9
+
+
+class PcapError(ValueError):
+    pass
+
+
+def read_pcap(file):
+    """Yield a (capture_dts, linktype, frame) tuple for each record of an open
+    pcap or pcapng file. The records are read one by one, so the file may be
+    larger than memory. The capture timestamps are converted to local time,
+    like the timestamps of live captures.
+    """
+    magic = file.read(4)
+    if len(magic) < 4:
+        raise PcapError("Not a pcap file: {}".format(file.name))
+    if struct.unpack('<I', magic)[0] == SECTION_HEADER_BLOCK:
+        return _read_pcapng(file, magic)
+    return _read_pcap(file, magic)
+
+
+def _read_pcap(file, magic):
+    header = magic + file.read(20)
+    if len(header) < 24:
+        raise PcapError("Not a pcap file: {}".format(file.name))
+    for byte_order in ('<', '>'):
+        magic = struct.unpack(byte_order + 'I', header[:4])[0]
+        if magic in (MAGIC_US, MAGIC_NS):
+            break
+    else:
+        raise PcapError("Not a pcap file: {}".format(file.name))
+    units = 1000000000 if magic == MAGIC_NS else 1000000
+    linktype = struct.unpack(byte_order + 'I', header[20:24])[0]
+    record = struct.Struct(byte_order + 'IIII')
+    while True:
+        header = file.read(record.size)
+        if len(header) < record.size:
+            break
+        seconds, fraction, size, original_size = record.unpack(header)
+        frame = file.read(size)
+        if len(frame) < size:
+            log.warn("Truncated record at the end of {}".format(file.name))
+            break
+        yield _capture_dts(seconds, fraction, units), linktype, frame
+
+
+def _read_pcapng(file, block_type):
+    """Read the enhanced packet blocks of a pcapng file. Other blocks, except
+    section headers and interface descriptions, are skipped."""
+    byte_order = '<'
+    interfaces = []
+    while True:
+        header = block_type + file.read(4)
+        if len(header) < 8:
+            break
+        if struct.unpack('<I', block_type)[0] == SECTION_HEADER_BLOCK:
+            magic = file.read(4)
+            byte_order = '<' if struct.unpack('<I', magic)[0] == \
+                BYTE_ORDER_MAGIC else '>'
+            length = struct.unpack(byte_order + 'I', header[4:])[0]
+            body = magic + file.read(length - 16)
+            block_type = SECTION_HEADER_BLOCK
+            interfaces = []
+        else:
+            block_type, length = struct.unpack(byte_order + 'II', header)
+            body = file.read(length - 12)
+        if len(body) < length - 12 or len(file.read(4)) < 4:
+            log.warn("Truncated block at the end of {}".format(file.name))
+            break
+        if block_type == INTERFACE_DESCRIPTION_BLOCK:
+            linktype = struct.unpack(byte_order + 'H', body[:2])[0]
+            interfaces.append((linktype, _tsresol(body[8:], byte_order)))
+        elif block_type == ENHANCED_PACKET_BLOCK:
+            interface, high, low, size = struct.unpack(byte_order + 'IIII',
+                                                       body[:16])
+            linktype, units = interfaces[interface]
+            seconds, fraction = divmod((high << 32) | low, units)
+            yield (_capture_dts(seconds, fraction, units), linktype,
+                   body[20:20 + size])
+        block_type = file.read(4)
+
+
+def _tsresol(options, byte_order):
+    """Return the number of timestamp units per second of an interface."""
+    offset = 0
+    while offset + 4 <= len(options):
+        code, size = struct.unpack(byte_order + 'HH',
+                                   options[offset:offset + 4])
+        if code == 0:
+            break
+        if code == OPTION_TSRESOL and size:
+            resolution = ord(options[offset + 4])
+            if resolution & 0x80:
+                return 2 ** (resolution & 0x7f)
+            return 10 ** resolution
+        offset += 4 + (size + 3) // 4 * 4
+    return 1000000
+
+
+def _capture_dts(seconds, fraction, units):
+    return datetime.datetime.fromtimestamp(seconds).replace(
+        microsecond=fraction * 1000000 // units)
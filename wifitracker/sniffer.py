@@ -1,29 +1,62 @@
+from collections import OrderedDict
 import datetime
 import logging
+import multiprocessing
+import signal
+import time
+from threading import Lock, Thread
+try:
+    from queue import Queue, Empty, Full  # try python3
+except ImportError:
+    from Queue import Queue, Empty, Full
 
 from scapy.all import sniff as scapy_sniff
 from scapy.all import conf as scapy_conf
 from scapy.all import Dot11, Dot11ProbeReq
 
-from wifitracker.tracker import ProbeRequest, Tracker
+from wifitracker import dot11, metrics
+from wifitracker.capture import CaptureProcess, is_replay, merge_captures
+from wifitracker.coalesce import Coalescer
+from wifitracker.live import LiveAggregate, LiveServer
+from wifitracker.storage import STORAGES
+from wifitracker.tracker import ProbeRequest, Tracker, _from_epoch_us
 
 TRACKER = None
+QUEUE = None
 
 log = logging.getLogger(__name__)
 
 # constants for packet inspection:
 PR_TYPE = 0
 PR_SUBTYPE = 4
+CAPTURES = ('scapy', 'raw')
+
+PACKETS = metrics.counter(
+    'wifitracker_packets_total',
+    'Packets passed to the capture callback of the sniffer process.')
+PROBE_REQUESTS = metrics.counter(
+    'wifitracker_probe_requests_total',
+    'Captured probe requests.')
+DROPPED = metrics.counter(
+    'wifitracker_dropped_total',
+    'Captured probe requests dropped, since the queue was full.')
+DECODE_ERRORS = metrics.counter(
+    'wifitracker_decode_errors_total',
+    'Captured probe requests, which could not be parsed.')
+SUMMARIZE_SECONDS = metrics.histogram(
+    'wifitracker_summarize_seconds',
+    'Latency of parsing a captured probe request.')
 
 
 def _extract_rssi(packet):
-    """Extract the RSSi (received signal strength indicator) from a wifi packet.
+    """Extract the RSSi (received signal strength indicator) from the dBm
+    antenna signal field of the radiotap header of a wifi packet.
     """
     try:
-        extra = packet.notdecoded
-        signal_strength = -(256 - ord(extra[-4:-3]))
+        frame = getattr(packet, 'original', None) or str(packet)
+        signal_strength = dot11.parse_radiotap(frame)[1]
     except Exception as e:
-        log.error("Unable to extract RSSi from captured packet.", e)
+        log.error("Unable to extract RSSi from captured packet: {}".format(e))
         signal_strength = None
     return signal_strength
 
@@ -42,41 +75,325 @@ def _extract_ssid(packet):
     return ssid
 
 
+class CaptureQueue(object):
+    """Bounded queue between the capture callback and the writer threads.
+
+    The overflow policy decides what happens if the queue is full:
+    block       -- wait until a writer thread takes an item from the queue
+    drop-oldest -- discard the oldest queued item to make room for the new one
+    drop-newest -- discard the new item
+    """
+
+    OVERFLOW_POLICIES = ('block', 'drop-oldest', 'drop-newest')
+
+    def __init__(self, maxsize=10000, overflow='block'):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: {}".format(overflow))
+        self.overflow = overflow
+        self.queued = 0
+        self.dropped = 0
+        self._queue = Queue(maxsize)
+        self._lock = Lock()
+
+    def put(self, item):
+        """Put an item into the queue according to the overflow policy."""
+        if self.overflow == 'block':
+            self._queue.put(item)
+        elif self.overflow == 'drop-newest':
+            try:
+                self._queue.put_nowait(item)
+            except Full:
+                self._count_drop()
+                return
+        else:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    break
+                except Full:
+                    try:
+                        self._queue.get_nowait()
+                        self._queue.task_done()
+                        self._count_drop()
+                    except Empty:
+                        pass
+        with self._lock:
+            self.queued += 1
+
+    def _count_drop(self):
+        DROPPED.inc()
+        with self._lock:
+            self.dropped += 1
+
+    def get(self, timeout=None):
+        return self._queue.get(timeout=timeout)
+
+    def task_done(self):
+        self._queue.task_done()
+
+    def stop(self, writers):
+        """Tell the given number of writer threads to stop after they have
+        processed all queued items."""
+        for i in range(writers):
+            self._queue.put(None)
+
+    def stats(self):
+        with self._lock:
+            return {'queued': self.queued,
+                    'dropped': self.dropped,
+                    'pending': self._queue.qsize()}
+
+
+class WriterThread(Thread):
+    """Consumer thread which turns queued packets into probe requests and
+    adds them to the tracker.
+
+    summarize -- function which creates a ProbeRequest from a queued item
+                 (see packet_handler and raw_packet_handler) and its capture
+                 timestamp
+    aggregate -- LiveAggregate, which is updated with each added request
+    coalescer -- Coalescer, which collapses bursts of requests before they
+                 are added
+    """
+
+    def __init__(self, queue, tracker, summarize=None, aggregate=None,
+                 coalescer=None):
+        super(WriterThread, self).__init__()
+        self.queue = queue
+        self.tracker = tracker
+        self.summarize = summarize if summarize else summarize_fields
+        self.aggregate = aggregate
+        self.coalescer = coalescer
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    break
+                capture_dts, packet = item
+                handle_probe_request(packet, capture_dts, self.tracker,
+                                     self.summarize, self.aggregate,
+                                     self.coalescer)
+            finally:
+                self.queue.task_done()
+
+
 def packet_handler(packet):
+    """Capture callback: only filters probe requests and queues their source
+    MAC, SSID and RSSi together with their capture timestamp, so that the
+    queue does not keep the scapy packets alive. All further work is done by
+    WriterThreads (see summarize_fields).
+    """
+    PACKETS.inc()
     if packet.haslayer(Dot11):
         if (packet.type == PR_TYPE and packet.subtype == PR_SUBTYPE):
-            request = summarize_probe_request(packet)
-            log.info("captured probe request: {}".format(request))
-            try:
-                TRACKER.add_request(request)
-            except Exception as e:
-                print e
-                log.error('Unable to add request', e)
+            PROBE_REQUESTS.inc()
+            QUEUE.put((datetime.datetime.now(),
+                       _probe_request_fields(packet)))
+
 
+def raw_packet_handler(frame):
+    """Capture callback of the raw capture: queues probe requests, which are
+    parsed by dot11.parse_probe_request in the WriterThreads."""
+    PACKETS.inc()
+    if dot11.is_probe_request(frame):
+        PROBE_REQUESTS.inc()
+        QUEUE.put((datetime.datetime.now(), frame))
 
-def summarize_probe_request(packet):
+
+def _merged_frame_handler(capture_us, frame):
+    """Queues the probe requests merged from the capture processes."""
+    PROBE_REQUESTS.inc()
+    QUEUE.put((_from_epoch_us(capture_us), frame))
+
+
+def handle_probe_request(packet, capture_dts, tracker, summarize=None,
+                         aggregate=None, coalescer=None):
+    summarize = summarize if summarize else summarize_fields
+    start = time.time()
+    request = summarize(packet, capture_dts)
+    SUMMARIZE_SECONDS.since(start)
+    if request is None:
+        DECODE_ERRORS.inc()
+        log.warn("Unable to parse captured packet.")
+        return
+    log.info("captured probe request: {}".format(request))
+    if coalescer:
+        coalescer.add(request)
+    else:
+        store_request(request, tracker, aggregate)
+
+
+def store_request(request, tracker, aggregate=None):
+    """Add a request to the tracker and the live aggregate."""
+    try:
+        tracker.add_request(request)
+    except Exception as e:
+        log.error("Unable to add request: {}".format(e))
+        return
+    if aggregate:
+        aggregate.add_request(request)
+
+
+def summarize_probe_request(packet, capture_dts=None):
     """Creates a ProbeRequest object from a 802.11 packet.
     """
-    now = datetime.datetime.now()
-    ssid = _extract_ssid(packet)
-    rssi = _extract_rssi(packet)
-    mac = packet.addr2.lower()
+    return summarize_fields(_probe_request_fields(packet), capture_dts)
+
+
+def summarize_fields(fields, capture_dts=None):
+    """Creates a ProbeRequest object from the (source MAC, SSID, RSSi) tuple
+    of a probe request. None is returned for None fields.
+    """
+    if fields is None:
+        return None
+    mac, ssid, rssi = fields
+    now = capture_dts if capture_dts else datetime.datetime.now()
     return ProbeRequest(source_mac=mac, capture_dts=now,
                         target_ssid=ssid, signal_strength=rssi)
 
 
-def sniff(interface):
-    """Runs scapy.sniff() and calls a handler function (new thread) for each
-    captured packet, matching the filter criteria.
+def _probe_request_fields(packet):
+    """Extract the source MAC, SSID and RSSi of a captured probe request.
+    None is returned if the packet has no source MAC.
     """
-    global TRACKER
-    TRACKER = Tracker('/var/opt/wifi-tracker')
-    # The interface needs to be set explicitly due to a bug in scapy.
-    # It is not sufficient to pass iface to the scniff function.
-    scapy_conf.iface = interface
-    # The filter only works on the assumption that only 802.11 packets are
-    # received.
-    # for more information on the filter, see man pages of tcpdump
-    scapy_sniff(prn=packet_handler,
-                filter='type mgt subtype probe-req',
-                store=0)
+    mac = packet.addr2
+    if not mac:
+        return None
+    return mac.lower(), _extract_ssid(packet), _extract_rssi(packet)
+
+
+def _terminate(signum, frame):
+    """Signal handler which stops the sniffer gracefully."""
+    raise SystemExit(0)
+
+
+def sniff(interfaces, queue_size=10000, overflow='block', writers=1,
+          storage='json', storage_options=None, capture='scapy',
+          schedule=None, replay_speed=1.0, coalesce=None, metrics_file=None):
+    """Runs scapy.sniff() and queues each captured packet matching the filter
+    criteria. The queued packets are processed by writer threads.
+
+    The raw capture reads the frames from an AF_PACKET socket and parses
+    them with wifitracker.dot11 instead of scapy, which is much faster.
+
+    Several interfaces, channel hopping and replayed pcap files
+    (replay:<file>) are captured by one process per interface. Their frames
+    are merged in timestamp order and parsed with wifitracker.dot11 (see
+    wifitracker.capture). The order is kept by the tracker with a single
+    writer thread.
+
+    While sniffing, the devices and stations of all requests are kept in
+    memory and served to the show command on a Unix domain socket (see
+    wifitracker.live).
+
+    Bursts of requests of a device for the same SSID can be stored as one
+    record (see wifitracker.coalesce).
+
+    Keyword arguments:
+    interfaces -- name of the interface, or list of names
+    queue_size -- maximum number of packets waiting to be processed
+    overflow -- overflow policy of the queue (see CaptureQueue)
+    writers -- number of writer threads
+    storage -- name of the storage backend (see wifitracker.storage)
+    storage_options -- dict of additional arguments of the storage backend
+    capture -- capture engine: scapy or raw
+    schedule -- channel hop schedule of each interface, list of (channel,
+                dwell) tuples (see wifitracker.capture.parse_hop_schedule)
+    replay_speed -- speed of replayed pcap files (see
+                    wifitracker.capture.replay)
+    coalesce -- time window of bursts in seconds, None to store each request
+    metrics_file -- file to which the metrics are written in the Prometheus
+                    text format every 10 seconds
+    """
+    global TRACKER, QUEUE
+    if capture not in CAPTURES:
+        raise ValueError("Unknown capture engine: {}".format(capture))
+    # validated before the capture processes are started:
+    if storage not in STORAGES:
+        raise ValueError("Unknown storage: {}".format(storage))
+    if coalesce and not STORAGES[storage].coalesced:
+        raise ValueError("The {} storage can not store coalesced requests."
+                         .format(storage))
+    if isinstance(interfaces, basestring):
+        interfaces = [interfaces]
+    processes = []
+    if len(interfaces) > 1 or schedule or is_replay(interfaces[0]):
+        frames = multiprocessing.Queue(queue_size)
+        # start each interface at another channel of the schedule:
+        processes = [CaptureProcess(i, interface, frames, capture, schedule,
+                                    offset=i * len(schedule or []) //
+                                    len(interfaces),
+                                    replay_speed=replay_speed)
+                     for i, interface in enumerate(interfaces)]
+        # fork before files and sockets are opened:
+        for process in processes:
+            process.start()
+    TRACKER = Tracker('/var/opt/wifi-tracker', storage=storage,
+                      storage_options=storage_options, live=False)
+    # index requests written while the sniffer was not running:
+    TRACKER.update_index()
+    # all stored requests, even if they were captured after now:
+    aggregate = LiveAggregate(TRACKER.get_snapshot(datetime.datetime.max),
+                              TRACKER.storage.escape_ssid)
+    coalescer = None
+    if coalesce:
+        coalescer = Coalescer(lambda request: store_request(
+            request, TRACKER, aggregate), window=coalesce)
+    QUEUE = CaptureQueue(queue_size, overflow)
+
+    def stats():
+        stats = OrderedDict([('metrics', metrics.REGISTRY.dump()),
+                             ('queue', QUEUE.stats()),
+                             ('writer', TRACKER.stats())])
+        if coalescer:
+            stats['coalescer'] = coalescer.stats()
+        return stats
+    server = LiveServer(TRACKER.live_filename, aggregate, stats)
+    server.start()
+    writer = metrics.PrometheusWriter(metrics_file) if metrics_file else None
+    if writer:
+        writer.start()
+    summarize = dot11.parse_probe_request if capture == 'raw' or processes \
+        else None
+    threads = [WriterThread(QUEUE, TRACKER, summarize, aggregate, coalescer)
+               for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    # make sure buffered requests are written when the sniffer gets killed:
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        if processes:
+            # the capture processes count the packets in their own registry:
+            merge_captures(processes, frames, _merged_frame_handler,
+                           counter=PACKETS.inc)
+        elif capture == 'raw':
+            dot11.capture(interfaces[0], raw_packet_handler)
+        else:
+            # The interface needs to be set explicitly due to a bug in scapy.
+            # It is not sufficient to pass iface to the scniff function.
+            scapy_conf.iface = interfaces[0]
+            # The filter only works on the assumption that only 802.11
+            # packets are received.
+            # for more information on the filter, see man pages of tcpdump
+            scapy_sniff(prn=packet_handler,
+                        filter='type mgt subtype probe-req',
+                        store=0)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        server.stop()
+        QUEUE.stop(len(threads))
+        for thread in threads:
+            thread.join()
+        if coalescer:
+            coalescer.close()
+            log.info("coalescer stats: {}".format(dict(coalescer.stats())))
+        TRACKER.close()
+        if writer:
+            writer.stop()
+        log.info("queue stats: {}".format(QUEUE.stats()))
+        log.info("writer stats: {}".format(dict(TRACKER.stats())))
@@ -0,0 +1,1382 @@
+import binascii
+import datetime
+import gzip
+import json
+import logging
+import mmap
+import os
+import os.path
+import shutil
+import sqlite3
+import struct
+import zlib
+from cStringIO import StringIO
+from itertools import islice
+from threading import RLock
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from wifitracker import metrics
+from wifitracker.tracker import (CoalescedRequest, Device, ProbeRequest,
+                                 RequestWriter, Station, _epoch_us,
+                                 _escape_ssid, _filter_requests,
+                                 _load_request_lines,
+                                 _strftime, _strptime, json_compact)
+
+CODECS = {'gzip': 1, 'zstd': 2}
+
+log = logging.getLogger(__name__)
+
+SCAN_BYTES = metrics.counter('wifitracker_scan_bytes_total',
+                             'Bytes read by scans of the storage.')
+
+
+class JsonStorage(object):
+    """Stores requests as JSON objects, one per line, in the file 'requests'.
+
+    Positions in this storage are byte offsets of the lines in the file.
+    """
+
+    name = 'json'
+    coalesced = True
+
+    def __init__(self, storage_dir, buffer_size=64 * 1024, flush_interval=1.0):
+        self.filename = os.path.join(storage_dir, 'requests')
+        self.writer = RequestWriter(self.filename, max_bytes=buffer_size,
+                                    max_delay=flush_interval)
+        self.separator = self.writer.separator
+        self.listeners = self.writer.listeners
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def size(self):
+        """Position after the last written request."""
+        return os.path.getsize(self.filename) if self.exists() else 0
+
+    def append(self, request):
+        self.writer.write(json_compact(request), request)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+    def stats(self):
+        return self.writer.stats()
+
+    def decode(self, dumps):
+        """Decode requests serialized by this storage. The returned list
+        contains None for each dump which could not be decoded."""
+        return _load_request_lines(dumps)
+
+    def escape_ssid(self, ssid):
+        """Return a captured SSID the way it is read from this storage."""
+        return _escape_ssid(ssid)
+
+    def read_chunks(self, load_dts=None, chunk_size=10000, start=0,
+                    since=None, match=None):
+        """Yield chunks of requests captured before load_dts (and not before
+        since), beginning at the given position. If match is given, lines
+        which do not contain this string are skipped without decoding them.
+        """
+        if not load_dts:
+            load_dts = datetime.datetime.now()
+        load_us = _epoch_us(load_dts)
+        chunk_no = 0
+        with open(self.filename) as file:
+            file.seek(start)
+            while True:
+                chunk = list(islice(file, chunk_size))
+                if not chunk:
+                    break
+                SCAN_BYTES.inc(sum(len(line) for line in chunk))
+                chunk_no += 1
+                lines = [line for line in chunk if len(line) > 1 and
+                         (match is None or match in line)]
+                all = []
+                i = 0
+                for request in _load_request_lines(lines):
+                    i += 1
+                    if request:
+                        all.append(request)
+                    else:
+                        # ignore erroneous lines
+                        line_no = chunk_size * (chunk_no - 1) + i
+                        log.error("Unable to decode line at {}:{}".format(
+                            self.filename, line_no))
+                if not all:
+                    continue
+                if all[0].capture_us > load_us:
+                    # abort since we assume the requests are sorted
+                    break
+                yield _filter_requests(all, load_dts, since)
+
+    def read_tail(self, start, chunk_size=10000):
+        """Yield chunks of (offset, request) tuples of all requests written
+        after the given position, each together with the position after the
+        last complete request of the chunk.
+        """
+        return self.read_range(start, self.size(), chunk_size)
+
+    def read_range(self, start, end, chunk_size=10000):
+        """Yield chunks of (offset, request) tuples of the requests between
+        two positions, like read_tail."""
+        with open(self.filename, 'rb') as file:
+            for entries, chunk_end in _read_json_lines(
+                    file, start, end, chunk_size, self.filename):
+                yield entries, chunk_end
+
+    def split(self, start, parts):
+        """Split the requests written after the given position into at most
+        parts (start, end) ranges of about the same size. The ranges are
+        aligned to the beginning of lines."""
+        size = self.size()
+        bounds = [start]
+        with open(self.filename, 'rb') as file:
+            for i in xrange(1, parts):
+                bound = start + (size - start) * i // parts
+                if bound <= bounds[-1]:
+                    continue
+                # move the bound behind the next line break:
+                file.seek(bound - 1)
+                file.readline()
+                bound = min(file.tell(), size)
+                if bounds[-1] < bound < size:
+                    bounds.append(bound)
+        bounds.append(size)
+        return [(bounds[i], bounds[i + 1]) for i in xrange(len(bounds) - 1)
+                if bounds[i] < bounds[i + 1]]
+
+    def read_at(self, offsets):
+        """Read the requests at the given positions."""
+        with open(self.filename, 'rb') as file:
+            return _read_json_lines_at(file, offsets)
+
+
+class BinaryStorage(object):
+    """Stores requests as fixed-width binary records in the file
+    'requests.bin'.
+
+    Each record consists of the MAC (6 bytes), the capture timestamp in
+    microseconds since the epoch (int64), the RSSi (int8) and the id of the
+    SSID (uint32). The SSIDs are interned in the dictionary file 'ssids',
+    which holds one JSON string per line. The line number is the id of the
+    SSID, 0 means no SSID. Records are read through a memory map.
+
+    Positions in this storage are byte offsets of the records in the file.
+    Only one process may write to a binary storage at a time. Coalesced
+    requests can not be stored, since the records have no count.
+    """
+
+    name = 'binary'
+    coalesced = False
+    RECORD = struct.Struct('<6sqbI')
+    NO_RSSI = -128
+    NO_DTS = -2 ** 63
+
+    def __init__(self, storage_dir, buffer_size=64 * 1024, flush_interval=1.0):
+        self.filename = os.path.join(storage_dir, 'requests.bin')
+        self.ssid_filename = os.path.join(storage_dir, 'ssids')
+        self.writer = RequestWriter(self.filename, separator='',
+                                    max_bytes=buffer_size,
+                                    max_delay=flush_interval)
+        self.separator = self.writer.separator
+        self.listeners = self.writer.listeners
+        self._ssids = [None]
+        # ids by escaped and by captured SSID:
+        self._ssid_ids = {}
+        self._captured_ids = {}
+        self._load_ssids()
+
+    def _load_ssids(self):
+        """Read SSIDs added to the dictionary file since the last call."""
+        if not os.path.exists(self.ssid_filename):
+            return
+        with open(self.ssid_filename) as file:
+            for line in islice(file, len(self._ssids) - 1, None):
+                if not line.endswith('\n'):
+                    # incomplete line
+                    break
+                ssid = json.loads(line).encode('ascii')
+                self._ssid_ids[ssid] = len(self._ssids)
+                self._ssids.append(ssid)
+
+    def _intern(self, ssid):
+        """Return the id of the SSID and add it to the dictionary if it is
+        not yet known."""
+        if not ssid:
+            return 0
+        try:
+            return self._captured_ids[ssid]
+        except KeyError:
+            pass
+        escaped = _escape_ssid(ssid)
+        ssid_id = self._ssid_ids.get(escaped)
+        if ssid_id is None:
+            with open(self.ssid_filename, 'a') as file:
+                file.write(json.dumps(escaped) + '\n')
+            ssid_id = len(self._ssids)
+            self._ssid_ids[escaped] = ssid_id
+            self._ssids.append(escaped)
+        self._captured_ids[ssid] = ssid_id
+        return ssid_id
+
+    def _ssid(self, ssid_id):
+        if ssid_id >= len(self._ssids):
+            # written by another process since the dictionary was loaded
+            self._load_ssids()
+        return self._ssids[ssid_id]
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def size(self):
+        """Position after the last complete record."""
+        if not self.exists():
+            return 0
+        size = os.path.getsize(self.filename)
+        return size - size % self.RECORD.size
+
+    def append(self, request):
+        self.writer.write(self.pack(request), request)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+    def stats(self):
+        return self.writer.stats()
+
+    def pack(self, request):
+        if request.count != 1:
+            raise ValueError("Coalesced requests can not be stored in the "
+                             "binary storage.")
+        mac = binascii.unhexlify(request.source_mac.replace(':', ''))
+        dts = request.capture_us
+        dts = self.NO_DTS if dts is None else dts
+        rssi = request.signal_strength
+        rssi = self.NO_RSSI if rssi is None else max(-127, min(127, rssi))
+        return self.RECORD.pack(mac, dts, rssi,
+                                self._intern(request.target_ssid))
+
+    def unpack(self, record, offset=0):
+        mac, dts, rssi, ssid_id = self.RECORD.unpack_from(record, offset)
+        mac = binascii.hexlify(mac)
+        mac = ':'.join([mac[i:i + 2] for i in xrange(0, 12, 2)])
+        dts = None if dts == self.NO_DTS else dts
+        rssi = None if rssi == self.NO_RSSI else rssi
+        return ProbeRequest.from_us(mac, dts, target_ssid=self._ssid(ssid_id),
+                                    signal_strength=rssi)
+
+    def decode(self, records):
+        return [self.unpack(record) for record in records]
+
+    def escape_ssid(self, ssid):
+        return _escape_ssid(ssid)
+
+    def _map(self):
+        """Return a read only memory map of the record file, or None if the
+        file is empty."""
+        with open(self.filename, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_records(self, start, end, chunk_size):
+        """Yield chunks of (offset, request) tuples between two positions."""
+        records = self._map()
+        if records is None:
+            return
+        try:
+            size = self.RECORD.size
+            for chunk_start in xrange(start, end, chunk_size * size):
+                chunk_end = min(end, chunk_start + chunk_size * size)
+                SCAN_BYTES.inc(chunk_end - chunk_start)
+                yield [(offset, self.unpack(records, offset))
+                       for offset in xrange(chunk_start, chunk_end, size)]
+        finally:
+            records.close()
+
+    def read_chunks(self, load_dts=None, chunk_size=10000, start=0,
+                    since=None, match=None):
+        """Yield chunks of requests captured before load_dts (and not before
+        since), beginning at the given position. match is ignored, since
+        records are decoded without parsing."""
+        if not load_dts:
+            load_dts = datetime.datetime.now()
+        load_us = _epoch_us(load_dts)
+        for entries in self._read_records(start, self.size(), chunk_size):
+            all = [request for offset, request in entries]
+            if all[0].capture_us > load_us:
+                # abort since we assume the requests are sorted
+                break
+            yield _filter_requests(all, load_dts, since)
+
+    def read_tail(self, start, chunk_size=10000):
+        """Yield chunks of (offset, request) tuples of all requests written
+        after the given position, each together with the position after the
+        last request of the chunk.
+        """
+        return self.read_range(start, self.size(), chunk_size)
+
+    def read_range(self, start, end, chunk_size=10000):
+        """Yield chunks of (offset, request) tuples of the requests between
+        two positions, like read_tail."""
+        for entries in self._read_records(start, end, chunk_size):
+            yield entries, entries[-1][0] + self.RECORD.size
+
+    def split(self, start, parts):
+        """Split the requests written after the given position into at most
+        parts (start, end) ranges of about the same size. The ranges are
+        aligned to the records."""
+        size = self.RECORD.size
+        count = max(0, self.size() - start) // size
+        bounds = sorted(set(start + count * i // parts * size
+                            for i in xrange(parts + 1)))
+        return zip(bounds[:-1], bounds[1:])
+
+    def read_at(self, offsets):
+        """Read the requests at the given positions."""
+        records = self._map()
+        if records is None:
+            return []
+        try:
+            return [self.unpack(records, offset) for offset in offsets]
+        finally:
+            records.close()
+
+
+class Segment(object):
+    """A file of a SegmentedStorage, which holds the requests captured in one
+    time bucket as JSON lines.
+
+    The file begins with a fixed-width header line, which records the number
+    of requests and the min and max capture_dts. Closed segments may be
+    compressed with gzip. The number of a segment is the number of hours
+    between the epoch and the beginning of its time bucket.
+    """
+
+    PREFIX = 'requests-'
+    HEADER = '#segment count={:012d} min={:26} max={:26}\n'
+    HEADER_SIZE = len(HEADER.format(0, '', ''))
+
+    def __init__(self, filename):
+        self.filename = filename
+        name = os.path.basename(filename)
+        self.compressed = name.endswith('.gz')
+        self.start_dts = datetime.datetime.strptime(
+            name[len(self.PREFIX):len(self.PREFIX) + 10], '%Y%m%d%H')
+        self.number = _epoch_us(self.start_dts) // 3600000000
+        self.count = 0
+        self.min_dts = None
+        self.max_dts = None
+
+    @classmethod
+    def create(cls, directory, start_dts):
+        """Return the segment for the time bucket beginning at start_dts. The
+        file is created if it does not exist yet. A compressed segment is
+        decompressed, so that requests can be appended to it."""
+        name = cls.PREFIX + start_dts.strftime('%Y%m%d%H')
+        segment = cls(os.path.join(directory, name))
+        if os.path.exists(segment.filename + '.gz'):
+            segment.decompress()
+        elif os.path.exists(segment.filename):
+            segment.read_header()
+        else:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            segment.write_header()
+        return segment
+
+    def open(self):
+        if self.compressed:
+            return gzip.open(self.filename, 'rb')
+        return open(self.filename, 'rb')
+
+    def size(self):
+        """Size of the uncompressed segment."""
+        if not self.compressed:
+            return os.path.getsize(self.filename)
+        with open(self.filename, 'rb') as file:
+            # gzip stores the uncompressed size in the last 4 bytes:
+            file.seek(-4, os.SEEK_END)
+            return struct.unpack('<I', file.read(4))[0]
+
+    def position(self, offset):
+        """Position of an offset of this segment in the SegmentedStorage."""
+        return (self.number << SegmentedStorage.OFFSET_BITS) | offset
+
+    def read_header(self):
+        with self.open() as file:
+            header = file.read(self.HEADER_SIZE)
+        # see HEADER for the positions of the fields:
+        self.count = int(header[15:27])
+        self.min_dts = _parse_header_dts(header[32:58])
+        self.max_dts = _parse_header_dts(header[63:89])
+
+    def write_header(self):
+        header = self.HEADER.format(self.count, _strftime(self.min_dts) or '',
+                                    _strftime(self.max_dts) or '')
+        mode = 'r+b' if os.path.exists(self.filename) else 'wb'
+        with open(self.filename, mode) as file:
+            file.write(header)
+
+    def add(self, capture_dts):
+        """Count a request, which is appended to this segment."""
+        self.count += 1
+        if capture_dts:
+            if self.min_dts is None or capture_dts < self.min_dts:
+                self.min_dts = capture_dts
+            if self.max_dts is None or capture_dts > self.max_dts:
+                self.max_dts = capture_dts
+
+    def compress(self):
+        """Replace the segment file by a gzip compressed copy."""
+        filename = self.filename + '.gz'
+        with open(self.filename, 'rb') as source:
+            target = gzip.open(filename + '.tmp', 'wb')
+            try:
+                shutil.copyfileobj(source, target)
+            finally:
+                target.close()
+        os.rename(filename + '.tmp', filename)
+        os.remove(self.filename)
+        self.filename = filename
+        self.compressed = True
+
+    def decompress(self):
+        """Replace the compressed file of the segment by an uncompressed
+        copy. An uncompressed file next to it is left behind by an
+        interrupted compression or decompression and already holds all
+        requests of the segment. Otherwise a ValueError is raised."""
+        filename = self.filename
+        if filename.endswith('.gz'):
+            filename = filename[:-3]
+        compressed = Segment(filename + '.gz')
+        compressed.read_header()
+        if os.path.exists(filename):
+            self.filename = filename
+            self.compressed = False
+            self.read_header()
+            if self.count != compressed.count:
+                raise ValueError(
+                    "Segment {} holds {} requests, its compressed copy {}"
+                    .format(filename, self.count, compressed.count))
+            os.remove(filename + '.gz')
+            return
+        with open(filename + '.tmp', 'wb') as target:
+            with compressed.open() as source:
+                shutil.copyfileobj(source, target)
+        os.rename(filename + '.tmp', filename)
+        os.remove(filename + '.gz')
+        self.filename = filename
+        self.compressed = False
+        self.min_dts = compressed.min_dts
+        self.max_dts = compressed.max_dts
+        self.count = compressed.count
+
+
+class SegmentedStorage(object):
+    """Stores requests as JSON lines in time bucketed segment files in the
+    directory 'segments'.
+
+    Each segment covers an hour or a day (bucket) of capture timestamps and
+    records the min and max capture_dts in its header, so that queries skip
+    segments outside of the requested time range without reading them.
+    Closed segments can be compressed and removed by compact().
+
+    Positions in this storage combine the number of the segment (upper bits)
+    with the byte offset in the uncompressed segment (lower OFFSET_BITS bits).
+    """
+
+    name = 'segmented'
+    coalesced = True
+    BUCKETS = {'hour', 'day'}
+    OFFSET_BITS = 40
+    OFFSET_MASK = (1 << OFFSET_BITS) - 1
+
+    def __init__(self, storage_dir, buffer_size=64 * 1024, flush_interval=1.0,
+                 bucket='hour'):
+        if bucket not in self.BUCKETS:
+            raise ValueError("Unknown segment bucket: {}".format(bucket))
+        self.bucket = bucket
+        self.directory = os.path.join(storage_dir, 'segments')
+        self.filename = self.directory
+        self.writer = RequestWriter(None, max_bytes=buffer_size,
+                                    max_delay=flush_interval)
+        self.writer.listeners.append(self._flushed)
+        self.separator = self.writer.separator
+        self.listeners = []
+        self._segment = None
+        self._lock = RLock()
+
+    def segments(self):
+        """Return all segments ordered by time."""
+        if not os.path.isdir(self.directory):
+            return []
+        names = set(os.listdir(self.directory))
+        segments = []
+        for name in sorted(names):
+            if not name.startswith(Segment.PREFIX) or name.endswith('.tmp'):
+                continue
+            if not name.endswith('.gz') and name + '.gz' in names:
+                # the segment is being compressed or decompressed right now,
+                # both files hold all its requests
+                continue
+            segments.append(Segment(os.path.join(self.directory, name)))
+        return segments
+
+    def _bucket_start(self, dts):
+        dts = dts.replace(minute=0, second=0, microsecond=0)
+        if self.bucket == 'day':
+            dts = dts.replace(hour=0)
+        return dts
+
+    def exists(self):
+        return bool(self.segments())
+
+    def size(self):
+        """Position after the last written request."""
+        segments = self.segments()
+        if not segments:
+            return 0
+        return segments[-1].position(segments[-1].size())
+
+    def append(self, request):
+        with self._lock:
+            capture_dts = request.capture_dts
+            start = self._bucket_start(capture_dts if capture_dts
+                                       else datetime.datetime.now())
+            # requests are only written to newer segments, since older
+            # segments might already be compressed:
+            if self._segment is None or start > self._segment.start_dts:
+                segment = Segment.create(self.directory, start)
+                self.writer.switch(segment.filename)
+                self._segment = segment
+            self._segment.add(capture_dts)
+            self.writer.write(json_compact(request), request)
+
+    def _flushed(self, batch, end):
+        """Update the header of the current segment and notify listeners
+        about the positions of the written requests."""
+        segment = self._segment
+        segment.write_header()
+        batch = [(segment.position(offset), dump) for offset, dump in batch]
+        for listener in self.listeners:
+            listener(batch, segment.position(end))
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+    def stats(self):
+        return self.writer.stats()
+
+    def decode(self, dumps):
+        return _load_request_lines(dumps)
+
+    def escape_ssid(self, ssid):
+        return _escape_ssid(ssid)
+
+    def _start_offset(self, segment, start):
+        if segment.number == start >> self.OFFSET_BITS:
+            return max(start & self.OFFSET_MASK, Segment.HEADER_SIZE)
+        return Segment.HEADER_SIZE
+
+    def read_chunks(self, load_dts=None, chunk_size=10000, start=0,
+                    since=None, match=None):
+        """Yield chunks of requests captured before load_dts (and not before
+        since), beginning at the given position. Segments without requests
+        in this time range are skipped, like lines which do not contain
+        match."""
+        if not load_dts:
+            load_dts = datetime.datetime.now()
+        segments = self.segments()
+        for i, segment in enumerate(segments):
+            if segment.number < start >> self.OFFSET_BITS:
+                continue
+            # the header of the last segment might not be up to date yet:
+            if i < len(segments) - 1:
+                segment.read_header()
+                if not segment.count or segment.min_dts >= load_dts or \
+                        (since and segment.max_dts < since):
+                    log.debug("skipped segment {}".format(segment.filename))
+                    continue
+            for entries, end in self._read_segment(
+                    segment, self._start_offset(segment, start), chunk_size,
+                    match):
+                yield _filter_requests([r for offset, r in entries],
+                                       load_dts, since)
+
+    def _read_segment(self, segment, offset, chunk_size, match=None):
+        with segment.open() as file:
+            for entries, end in _read_json_lines(file, offset, segment.size(),
+                                                 chunk_size, segment.filename,
+                                                 match):
+                yield entries, end
+
+    def read_tail(self, start, chunk_size=10000):
+        """Yield chunks of (position, request) tuples of all requests written
+        after the given position, each together with the position after the
+        last complete request of the chunk.
+        """
+        return self.read_range(start, self.size(), chunk_size)
+
+    def read_range(self, start, end, chunk_size=10000):
+        """Yield chunks of (position, request) tuples of the requests between
+        two positions, like read_tail."""
+        for segment in self.segments():
+            if segment.number < start >> self.OFFSET_BITS:
+                continue
+            if segment.number > end >> self.OFFSET_BITS:
+                break
+            size = segment.size()
+            if segment.number == end >> self.OFFSET_BITS:
+                size = min(size, end & self.OFFSET_MASK)
+            with segment.open() as file:
+                for entries, chunk_end in _read_json_lines(
+                        file, self._start_offset(segment, start), size,
+                        chunk_size, segment.filename):
+                    yield ([(segment.position(offset), request)
+                            for offset, request in entries],
+                           segment.position(chunk_end))
+
+    def split(self, start, parts):
+        """Split the requests written after the given position into (start,
+        end) ranges, one per segment, since compressed segments can only be
+        read sequentially."""
+        ranges = []
+        for segment in self.segments():
+            if segment.number < start >> self.OFFSET_BITS:
+                continue
+            range_start = segment.position(self._start_offset(segment, start))
+            range_end = segment.position(segment.size())
+            if range_start < range_end:
+                ranges.append((range_start, range_end))
+        return ranges
+
+    def read_at(self, positions):
+        """Read the requests at the given positions."""
+        offsets = {}
+        for position in positions:
+            offsets.setdefault(position >> self.OFFSET_BITS, []).append(
+                position & self.OFFSET_MASK)
+        requests = []
+        for segment in self.segments():
+            if segment.number in offsets:
+                with segment.open() as file:
+                    requests += _read_json_lines_at(file,
+                                                    offsets[segment.number])
+        return requests
+
+    def compact(self, now=None, compress=True, retention=None):
+        """Compress closed segments and remove segments with requests older
+        than the retention period. Returns the number of removed segments.
+
+        Keyword arguments:
+        compress -- whether closed segments should be compressed
+        retention -- timedelta, segments are kept forever if None
+        """
+        if not now:
+            now = datetime.datetime.now()
+        current = self._bucket_start(now)
+        removed = 0
+        for segment in self.segments():
+            if segment.start_dts >= current or (
+                    self._segment and segment.number == self._segment.number):
+                # the segment might still be written
+                continue
+            segment.read_header()
+            if retention and (segment.max_dts is None or
+                              segment.max_dts < now - retention):
+                log.info("removing segment {}".format(segment.filename))
+                os.remove(segment.filename)
+                removed += 1
+            elif compress and not segment.compressed:
+                log.info("compressing segment {}".format(segment.filename))
+                segment.compress()
+        return removed
+
+
+class Block(object):
+    """A compressed block of JSON lines in the file of a BlockStorage.
+
+    The block begins with a fixed-width binary header (HEADER), which records
+    the codec, the number of requests, the min and max capture timestamps in
+    microseconds since the epoch and the compressed and uncompressed size of
+    the following data. Each block can be decompressed on its own.
+    """
+
+    MAGIC = 'WTB1'
+    HEADER = struct.Struct('<4sBIqqII')
+    NO_DTS = -2 ** 63
+
+    def __init__(self, offset, codec, count, min_us, max_us, length, size):
+        self.offset = offset
+        self.codec = codec
+        self.count = count
+        self.min_us = min_us
+        self.max_us = max_us
+        self.length = length
+        self.size = size
+
+    @classmethod
+    def pack(cls, codec, lines, min_us, max_us):
+        """Compress JSON lines into a block. Returns the header and the
+        compressed data."""
+        data = _compress(codec, lines)
+        header = cls.HEADER.pack(
+            cls.MAGIC, codec, lines.count('\n'),
+            cls.NO_DTS if min_us is None else min_us,
+            cls.NO_DTS if max_us is None else max_us, len(data), len(lines))
+        return header + data
+
+    @classmethod
+    def unpack(cls, offset, header):
+        magic, codec, count, min_us, max_us, length, size = \
+            cls.HEADER.unpack(header)
+        if magic != cls.MAGIC:
+            raise ValueError("No block at offset {}".format(offset))
+        return cls(offset, codec, count,
+                   None if min_us == cls.NO_DTS else min_us,
+                   None if max_us == cls.NO_DTS else max_us, length, size)
+
+    @property
+    def end(self):
+        """Byte offset after the block."""
+        return self.offset + self.HEADER.size + self.length
+
+    def position(self, offset):
+        """Position of an offset of the uncompressed data in the
+        BlockStorage."""
+        return (self.offset << BlockStorage.OFFSET_BITS) | offset
+
+    def read(self, file):
+        """Return the uncompressed JSON lines of the block."""
+        file.seek(self.offset + self.HEADER.size)
+        return _decompress(self.codec, file.read(self.length))
+
+
+def _compress(codec, data):
+    if codec == CODECS['zstd']:
+        return zstandard.ZstdCompressor().compress(data)
+    # a gzip member, which can be read with gzip.open or zcat on its own:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decompress(codec, data):
+    if codec == CODECS['zstd']:
+        if zstandard is None:
+            raise ValueError("Reading zstd blocks requires the zstandard "
+                             "package.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class BlockWriter(RequestWriter):
+    """RequestWriter, which appends the buffered requests as one compressed
+    Block to the file of a BlockStorage on each flush."""
+
+    def __init__(self, filename, codec, max_bytes=64 * 1024, max_delay=1.0):
+        super(BlockWriter, self).__init__(filename, separator='',
+                                          max_bytes=max_bytes,
+                                          max_delay=max_delay)
+        self.codec = codec
+        self._min_us = None
+        self._max_us = None
+
+    def add(self, dump, request):
+        """Append one serialized request to the buffer."""
+        capture_us = request.capture_us
+        with self._lock:
+            if capture_us is not None:
+                if self._min_us is None or capture_us < self._min_us:
+                    self._min_us = capture_us
+                if self._max_us is None or capture_us > self._max_us:
+                    self._max_us = capture_us
+            self.write(dump + '\n', request)
+
+    def _pack(self, position):
+        block = Block(position, self.codec, len(self._buffer), self._min_us,
+                      self._max_us, 0, 0)
+        batch = []
+        offset = 0
+        for data, request in zip(self._buffer, self._requests):
+            batch.append((block.position(offset), request))
+            offset += len(data)
+        data = Block.pack(self.codec, ''.join(self._buffer), self._min_us,
+                          self._max_us)
+        self._min_us = None
+        self._max_us = None
+        return data, batch, (position + len(data)) << BlockStorage.OFFSET_BITS
+
+
+class BlockStorage(object):
+    """Stores requests as compressed blocks of JSON lines in the file
+    'requests.blocks'.
+
+    Each flush of the writer appends one Block, so the size of the blocks is
+    bounded by buffer_size and flush_interval. The headers of the blocks
+    record the min and max capture timestamps, so that queries skip blocks
+    outside of the requested time range without decompressing them. Ranges
+    of blocks are decompressed in parallel by the --jobs option.
+
+    Blocks are gzip members by default, or compressed with zstd if the
+    zstandard package is installed (codec option). Positions in this storage
+    combine the byte offset of the block in the file (upper bits) with the
+    offset in the uncompressed block (lower OFFSET_BITS bits).
+    """
+
+    name = 'compressed'
+    coalesced = True
+    OFFSET_BITS = 24
+    OFFSET_MASK = (1 << OFFSET_BITS) - 1
+    # uncompressed blocks must fit in OFFSET_BITS:
+    MAX_BLOCK_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, storage_dir, buffer_size=64 * 1024, flush_interval=1.0,
+                 codec='gzip'):
+        if codec not in CODECS:
+            raise ValueError("Unknown codec: {}".format(codec))
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError("The zstd codec requires the zstandard package.")
+        self.codec = codec
+        self.filename = os.path.join(storage_dir, 'requests.blocks')
+        self.writer = BlockWriter(self.filename, CODECS[codec],
+                                  max_bytes=min(buffer_size,
+                                                self.MAX_BLOCK_SIZE),
+                                  max_delay=flush_interval)
+        self.separator = self.writer.separator
+        self.listeners = self.writer.listeners
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def size(self):
+        """Position after the last written block."""
+        if not self.exists():
+            return 0
+        return os.path.getsize(self.filename) << self.OFFSET_BITS
+
+    def append(self, request):
+        self.writer.add(json_compact(request), request)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+    def stats(self):
+        return self.writer.stats()
+
+    def decode(self, dumps):
+        return _load_request_lines(dumps)
+
+    def escape_ssid(self, ssid):
+        return _escape_ssid(ssid)
+
+    def _blocks(self, file, offset=0):
+        """Yield the complete blocks of an open file, beginning with the
+        block at the given byte offset."""
+        file.seek(0, os.SEEK_END)
+        file_size = file.tell()
+        while offset + Block.HEADER.size <= file_size:
+            file.seek(offset)
+            try:
+                block = Block.unpack(offset, file.read(Block.HEADER.size))
+            except ValueError as e:
+                log.error("Unable to read {}: {}".format(self.filename, e))
+                return
+            if block.end > file_size:
+                # the block is being written right now
+                return
+            yield block
+            offset = block.end
+
+    def _read_block(self, file, block, start, chunk_size, match=None):
+        """Decompress a block and yield chunks of (position, request) tuples
+        after the given position, each together with the position after the
+        last complete request of the chunk."""
+        offset = 0
+        if block.offset == start >> self.OFFSET_BITS:
+            offset = start & self.OFFSET_MASK
+        lines = StringIO(block.read(file))
+        for entries, end in _read_json_lines(lines, offset, block.size,
+                                             chunk_size, self.filename, match):
+            yield ([(block.position(line_offset), request)
+                    for line_offset, request in entries],
+                   block.end << self.OFFSET_BITS if end == block.size
+                   else block.position(end))
+
+    def read_chunks(self, load_dts=None, chunk_size=10000, start=0,
+                    since=None, match=None):
+        """Yield chunks of requests captured before load_dts (and not before
+        since), beginning at the given position. Blocks without requests in
+        this time range are skipped, like lines which do not contain
+        match."""
+        if not load_dts:
+            load_dts = datetime.datetime.now()
+        load_us = _epoch_us(load_dts)
+        since_us = _epoch_us(since) if since else None
+        with open(self.filename, 'rb') as file:
+            for block in self._blocks(file, start >> self.OFFSET_BITS):
+                if block.min_us is not None and (
+                        block.min_us >= load_us or
+                        (since_us and block.max_us < since_us)):
+                    continue
+                for entries, end in self._read_block(file, block, start,
+                                                     chunk_size, match):
+                    yield _filter_requests([r for position, r in entries],
+                                           load_dts, since)
+
+    def read_tail(self, start, chunk_size=10000):
+        """Yield chunks of (position, request) tuples of all requests written
+        after the given position, each together with the position after the
+        last complete request of the chunk.
+        """
+        return self.read_range(start, self.size(), chunk_size)
+
+    def read_range(self, start, end, chunk_size=10000):
+        """Yield chunks of (position, request) tuples of the requests between
+        two positions, like read_tail. The ranges must be aligned to blocks
+        (see split)."""
+        with open(self.filename, 'rb') as file:
+            for block in self._blocks(file, start >> self.OFFSET_BITS):
+                if block.position(0) >= end:
+                    break
+                for entries, chunk_end in self._read_block(file, block, start,
+                                                           chunk_size):
+                    yield entries, chunk_end
+
+    def split(self, start, parts):
+        """Split the requests written after the given position into at most
+        parts (start, end) ranges of about the same compressed size. The
+        ranges are aligned to the blocks."""
+        with open(self.filename, 'rb') as file:
+            ends = [block.end for block in
+                    self._blocks(file, start >> self.OFFSET_BITS)]
+        if not ends:
+            return []
+        first = start >> self.OFFSET_BITS
+        total = ends[-1] - first
+        bounds = [start]
+        for end in ends[:-1]:
+            if (end - first) * parts >= total * len(bounds):
+                bounds.append(end << self.OFFSET_BITS)
+        bounds.append(ends[-1] << self.OFFSET_BITS)
+        return zip(bounds[:-1], bounds[1:])
+
+    def read_at(self, positions):
+        """Read the requests at the given positions. Each block is
+        decompressed once."""
+        offsets = {}
+        for position in positions:
+            offsets.setdefault(position >> self.OFFSET_BITS, []).append(
+                position & self.OFFSET_MASK)
+        requests = []
+        with open(self.filename, 'rb') as file:
+            for block_offset in sorted(offsets):
+                file.seek(block_offset)
+                block = Block.unpack(block_offset,
+                                     file.read(Block.HEADER.size))
+                requests += _read_json_lines_at(StringIO(block.read(file)),
+                                                offsets[block_offset])
+        return requests
+
+
+class SqliteWriter(RequestWriter):
+    """RequestWriter, which inserts the buffered rows of a SqliteStorage in
+    one transaction per flush."""
+
+    def __init__(self, filename, max_bytes=64 * 1024, max_delay=1.0):
+        super(SqliteWriter, self).__init__(filename, separator='',
+                                           max_bytes=max_bytes,
+                                           max_delay=max_delay)
+        self._db = None
+
+    def add(self, row, request):
+        """Append the row (see SqliteStorage.COLUMNS) of a request to the
+        buffer."""
+        # estimated size of the row:
+        self._add(row, 32 + len(row[0]) + len(row[2] or ''), request)
+
+    def _write_buffer(self):
+        if self._db is None:
+            self._db = _connect_sqlite(self.filename)
+            # transactions are started explicitly:
+            self._db.isolation_level = None
+            self._db.execute('PRAGMA synchronous = NORMAL')
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(SqliteStorage.INSERT, self._buffer)
+            # the ids of the rows are consecutive, since the transaction
+            # holds the write lock:
+            end = db.execute('SELECT MAX(id) FROM requests').fetchone()[0]
+            db.execute('COMMIT')
+        except:
+            db.execute('ROLLBACK')
+            raise
+        first = end - len(self._buffer)
+        batch = [(first + i, request)
+                 for i, request in enumerate(self._requests)]
+        return self._buffer_bytes, batch, end
+
+    def close(self):
+        with self._lock:
+            super(SqliteWriter, self).close()
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def _connect_sqlite(filename):
+    """Open the database of a SqliteStorage in WAL mode and create its
+    tables and indexes if they do not exist yet."""
+    db = sqlite3.connect(filename, check_same_thread=False)
+    db.text_factory = str
+    db.execute('PRAGMA journal_mode = WAL')
+    db.execute('CREATE TABLE IF NOT EXISTS requests '
+               '(id INTEGER PRIMARY KEY AUTOINCREMENT, '
+               'source_mac TEXT NOT NULL, capture_us INTEGER, '
+               'target_ssid TEXT, signal_strength INTEGER, '
+               'count INTEGER NOT NULL DEFAULT 1, last_us INTEGER, '
+               'signal_min INTEGER, signal_max INTEGER)')
+    db.execute('CREATE INDEX IF NOT EXISTS requests_source_mac '
+               'ON requests (source_mac, capture_us)')
+    db.execute('CREATE INDEX IF NOT EXISTS requests_target_ssid '
+               'ON requests (target_ssid, capture_us)')
+    db.execute('CREATE TABLE IF NOT EXISTS aliases '
+               '(device_mac TEXT PRIMARY KEY, alias TEXT)')
+    db.commit()
+    return db
+
+
+class SqliteStorage(object):
+    """Stores requests in the table 'requests' of the SQLite database
+    'requests.db'.
+
+    The database is written in WAL mode, so the sniffer inserts requests
+    while other processes read them. Each flush of the writer inserts the
+    buffered requests in one transaction. Requests are indexed by
+    (source_mac, capture_us) and (target_ssid, capture_us), so single devices
+    and stations are looked up without RequestIndex (see find), and devices
+    and stations are aggregated by GROUP BY queries (see aggregate). Aliases
+    of devices are stored in the table 'aliases' of the same database.
+
+    Positions in this storage are the ids of the rows minus one, so the
+    position after a request is its id.
+    """
+
+    name = 'sqlite'
+    coalesced = True
+    COLUMNS = ('source_mac', 'capture_us', 'target_ssid', 'signal_strength',
+               'count', 'last_us', 'signal_min', 'signal_max')
+    INSERT = 'INSERT INTO requests ({}) VALUES ({})'.format(
+        ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+    SELECT = 'SELECT {} FROM requests'.format(', '.join(COLUMNS))
+    FIELDS = ('source_mac', 'target_ssid')
+
+    def __init__(self, storage_dir, buffer_size=64 * 1024, flush_interval=1.0):
+        self.filename = os.path.join(storage_dir, 'requests.db')
+        self.writer = SqliteWriter(self.filename, max_bytes=buffer_size,
+                                   max_delay=flush_interval)
+        self.separator = self.writer.separator
+        self.listeners = self.writer.listeners
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            self._db = _connect_sqlite(self.filename)
+        return self._db
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def size(self):
+        """Position after the last written request."""
+        if not self.exists():
+            return 0
+        row = self._connect().execute(
+            'SELECT MAX(id) FROM requests').fetchone()
+        return row[0] or 0
+
+    def append(self, request):
+        signal_min = signal_max = None
+        if isinstance(request, CoalescedRequest):
+            signal_min, signal_max = request.signal_min, request.signal_max
+        ssid = request.target_ssid
+        self.writer.add((request.source_mac, request.capture_us,
+                         _escape_ssid(ssid) if ssid else None,
+                         request.signal_strength, request.count,
+                         request.last_us, signal_min, signal_max), request)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def stats(self):
+        return self.writer.stats()
+
+    def unpack(self, row):
+        source_mac, capture_us, target_ssid, signal_strength, count, \
+            last_us, signal_min, signal_max = row
+        if count != 1 or signal_min is not None:
+            return CoalescedRequest.from_us(
+                source_mac, capture_us, target_ssid, signal_strength, count,
+                last_us, signal_min, signal_max)
+        return ProbeRequest.from_us(source_mac, capture_us, target_ssid,
+                                    signal_strength)
+
+    def decode(self, rows):
+        return [self.unpack(row) for row in rows]
+
+    def escape_ssid(self, ssid):
+        return _escape_ssid(ssid)
+
+    def _time_range(self, load_dts, since):
+        """Return the SQL condition and the parameters, which select requests
+        captured before load_dts and not before since, like
+        _filter_requests."""
+        if since:
+            return ' AND capture_us >= ? AND capture_us < ?', \
+                [_epoch_us(since), _epoch_us(load_dts)]
+        # requests without timestamp are kept, like by _filter_requests:
+        return ' AND (capture_us < ? OR capture_us IS NULL)', \
+            [_epoch_us(load_dts)]
+
+    def _select(self, condition, parameters, chunk_size):
+        """Yield chunks of (position, request) tuples of the selected rows in
+        the order of their ids."""
+        cursor = self._connect().execute(
+            'SELECT id, {} FROM requests WHERE {} ORDER BY id'.format(
+                ', '.join(self.COLUMNS), condition), parameters)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [(row[0] - 1, self.unpack(row[1:])) for row in rows]
+
+    def read_chunks(self, load_dts=None, chunk_size=10000, start=0,
+                    since=None, match=None):
+        """Yield chunks of requests captured before load_dts (and not before
+        since), beginning at the given position. match is ignored, single
+        devices and stations are looked up with find."""
+        if not load_dts:
+            load_dts = datetime.datetime.now()
+        condition, parameters = self._time_range(load_dts, since)
+        for entries in self._select('id > ?' + condition,
+                                    [start] + parameters, chunk_size):
+            yield [request for position, request in entries]
+
+    def read_tail(self, start, chunk_size=10000):
+        """Yield chunks of (position, request) tuples of all requests written
+        after the given position, each together with the position after the
+        last request of the chunk.
+        """
+        return self.read_range(start, self.size(), chunk_size)
+
+    def read_range(self, start, end, chunk_size=10000):
+        """Yield chunks of (position, request) tuples of the requests between
+        two positions, like read_tail."""
+        if not self.exists():
+            return
+        for entries in self._select('id > ? AND id <= ?', [start, end],
+                                    chunk_size):
+            yield entries, entries[-1][0] + 1
+
+    def split(self, start, parts):
+        """Split the requests written after the given position into at most
+        parts (start, end) ranges of about the same number of requests."""
+        size = self.size()
+        bounds = sorted(set(start + max(0, size - start) * i // parts
+                            for i in xrange(parts + 1)))
+        return zip(bounds[:-1], bounds[1:])
+
+    def read_at(self, positions):
+        """Read the requests at the given positions."""
+        ids = [position + 1 for position in positions]
+        requests = []
+        # SQLite limits the number of parameters of a query:
+        for i in xrange(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            for entries in self._select('id IN ({})'.format(
+                    ', '.join('?' * len(chunk))), chunk, len(chunk)):
+                requests += [request for position, request in entries]
+        return requests
+
+    def find(self, field, key, load_dts=None, since=None, chunk_size=10000):
+        """Yield chunks of the requests with the given value of field
+        (source_mac or target_ssid), which were captured before load_dts and
+        not before since. The requests are looked up by the indexes of the
+        table."""
+        if field not in self.FIELDS:
+            raise ValueError("Field not indexed: {}".format(field))
+        if not self.exists():
+            return
+        if not load_dts:
+            load_dts = datetime.datetime.now()
+        condition, parameters = self._time_range(load_dts, since)
+        for entries in self._select('{} = ?'.format(field) + condition,
+                                    [key] + parameters, chunk_size):
+            yield [request for position, request in entries]
+
+    def aggregate(self, start=0, load_dts=None, since=None):
+        """Build the devices and stations of the requests written after the
+        given position with GROUP BY queries. Only requests captured before
+        load_dts and not before since are considered, unless load_dts is
+        None.
+
+        Returns a tuple of the dicts of devices and stations, like
+        Tracker.get_devices and Tracker.get_stations, and the position after
+        the last aggregated request.
+        """
+        end = self.size()
+        devices = {}
+        stations = {}
+        condition = 'id > ? AND id <= ?'
+        parameters = [start, end]
+        if load_dts:
+            time_range = self._time_range(load_dts, since)
+            condition += time_range[0]
+            parameters += time_range[1]
+        db = self._connect()
+        for id, last_seen_us in db.execute(
+                'SELECT source_mac, MAX(last_us) FROM requests WHERE {} '
+                'GROUP BY source_mac'.format(condition), parameters):
+            devices[id] = Device(id)
+            devices[id].last_seen_us = last_seen_us
+        # distinct (device, SSID) pairs in the order of their first request:
+        for id, ssid, first_us, last_us, count in db.execute(
+                'SELECT source_mac, target_ssid, MIN(capture_us), '
+                'MAX(last_us), SUM(count) FROM requests '
+                'WHERE target_ssid IS NOT NULL AND {} '
+                'GROUP BY source_mac, target_ssid ORDER BY MIN(id)'.format(
+                    condition), parameters):
+            devices[id].ssid_stats[ssid] = [first_us, last_us, count]
+            if ssid not in stations:
+                stations[ssid] = Station(ssid)
+            stations[ssid].device_stats[id] = [first_us, last_us, count]
+        return devices, stations, end
+
+    def get_aliases(self):
+        """Return the aliases of devices by device MAC."""
+        return dict(self._connect().execute(
+            'SELECT device_mac, alias FROM aliases'))
+
+    def set_alias(self, device_mac, alias):
+        db = self._connect()
+        with db:
+            db.execute('INSERT OR REPLACE INTO aliases VALUES (?, ?)',
+                       (device_mac, alias))
+
+
+STORAGES = {JsonStorage.name: JsonStorage,
+            BinaryStorage.name: BinaryStorage,
+            SegmentedStorage.name: SegmentedStorage,
+            BlockStorage.name: BlockStorage,
+            SqliteStorage.name: SqliteStorage}
+
+
+def open_storage(name, storage_dir, **kwargs):
+    """Create the storage backend with the given name."""
+    try:
+        storage = STORAGES[name]
+    except KeyError:
+        raise ValueError("Unknown storage: {}".format(name))
+    return storage(storage_dir, **kwargs)
+
+
+def convert(source, target, chunk_size=10000):
+    """Copy all requests of one storage to another one. Returns the number of
+    copied requests."""
+    count = 0
+    if not source.exists():
+        return count
+    for entries, end in source.read_tail(0, chunk_size):
+        for offset, request in entries:
+            # undo the escaping of SSIDs, which is done when they are read:
+            request.target_ssid = _unescape_ssid(request.target_ssid)
+            target.append(request)
+            count += 1
+        log.info("converted {} requests".format(count))
+    target.flush()
+    return count
+
+
+def _read_json_lines(file, start, size, chunk_size, filename, match=None):
+    """Yield chunks of (offset, request) tuples of the JSON lines in an open
+    file after the given position, each together with the position after the
+    last complete request of the chunk. Reading stops at size. If match is
+    given, lines which do not contain this string are skipped.
+    """
+    file.seek(start)
+    offset = start
+    end = start
+    while True:
+        lines = []
+        chunk_start = offset
+        while len(lines) < chunk_size and offset < size:
+            line = file.readline()
+            if not line:
+                break
+            if len(line) > 1 and (match is None or match in line):
+                lines.append((offset, line))
+            elif line.endswith('\n'):
+                # skipped, but complete
+                end = offset + len(line)
+            offset += len(line)
+        SCAN_BYTES.inc(offset - chunk_start)
+        requests = _load_request_lines([line for line_offset, line in lines])
+        entries = []
+        previous_end = end
+        for (line_offset, line), request in zip(lines, requests):
+            if request:
+                entries.append((line_offset, request))
+                end = line_offset + len(line)
+            elif line_offset + len(line) < size:
+                # ignore erroneous lines, except an incomplete last line
+                log.error("Unable to decode line at {}:{}".format(
+                    filename, line_offset))
+                end = line_offset + len(line)
+        if end == previous_end:
+            break
+        yield entries, end
+
+
+def _read_json_lines_at(file, offsets):
+    """Read the requests at the given positions of an open file."""
+    lines = []
+    for offset in offsets:
+        file.seek(offset)
+        lines.append(file.readline())
+    return [r for r in _load_request_lines(lines) if r]
+
+
+def _parse_header_dts(s):
+    s = s.strip()
+    return _strptime(s) if s else None
+
+
+def _unescape_ssid(ssid):
+    """Reverse the escaping of SSIDs read from a storage (see
+    tracker._escape_ssid)."""
+    if ssid and '\\' in ssid:
+        return ssid.decode('unicode_escape')
+    return ssid
@@ -4,21 +4,54 @@ import datetime
 import json
 import logging
 import os.path
-from threading import Thread
-from itertools import islice
-try:
-    from queue import Queue  # try python3
-except ImportError:
-    from Queue import Queue
+import time
+from threading import Event, RLock, Thread
 
 # http requests for humans:
 import requests
 
+from wifitracker import metrics
+from wifitracker.index import RequestIndex
+from wifitracker.oui import LOOKUP_URL, VendorResolver
+
 log = logging.getLogger(__name__)
 logging.getLogger('requests').setLevel(logging.WARNING)
 
+ADD_REQUEST_SECONDS = metrics.histogram(
+    'wifitracker_add_request_seconds',
+    'Latency of adding a request to the tracker.')
+FLUSH_SECONDS = metrics.histogram(
+    'wifitracker_flush_seconds',
+    'Latency of writing the buffered requests to the storage.')
+SCAN_ROWS = metrics.counter(
+    'wifitracker_scan_rows_total',
+    'Requests read by scans of the storage.')
+SCAN_SECONDS = metrics.histogram(
+    'wifitracker_scan_seconds',
+    'Time spent reading and decoding requests per scan of the storage.')
+VENDOR_DATABASE_HITS = metrics.counter(
+    'wifitracker_vendor_database_hits_total',
+    'Vendors found in the local OUI registry.')
+VENDOR_ONLINE_LOOKUPS = metrics.counter(
+    'wifitracker_vendor_online_lookups_total',
+    'Devices whose vendors were looked up online.')
+VENDOR_RESOLVE_SECONDS = metrics.histogram(
+    'wifitracker_vendor_resolve_seconds',
+    'Latency of the online vendor lookups of one query.')
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
 
 class ProbeRequest(object):
+    """A captured probe request. The capture timestamp is stored as
+    microseconds since the epoch (capture_us), which are cheaper to create
+    and compare than datetimes. capture_dts converts it on access.
+    """
+
+    __slots__ = ('source_mac', 'capture_us', 'target_ssid', 'signal_strength')
+
+    # a single request, see CoalescedRequest:
+    count = 1
 
     def __init__(self, source_mac, capture_dts,
                  target_ssid=None, signal_strength=None):
@@ -27,6 +60,33 @@ class ProbeRequest(object):
         self.target_ssid = target_ssid
         self.signal_strength = signal_strength
 
+    @classmethod
+    def from_us(cls, source_mac, capture_us, target_ssid=None,
+                signal_strength=None):
+        """Create a request with a capture timestamp in microseconds since
+        the epoch."""
+        request = cls.__new__(cls)
+        request.source_mac = source_mac
+        request.capture_us = capture_us
+        request.target_ssid = target_ssid
+        request.signal_strength = signal_strength
+        return request
+
+    @property
+    def capture_dts(self):
+        if self.capture_us is None:
+            return None
+        return _from_epoch_us(self.capture_us)
+
+    @capture_dts.setter
+    def capture_dts(self, capture_dts):
+        self.capture_us = None if capture_dts is None else \
+            _epoch_us(capture_dts)
+
+    @property
+    def last_us(self):
+        return self.capture_us
+
     def __str__(self):
         return "SENDER='{}', SSID='{}', RSSi={}".format(self.source_mac,
                                                         self.target_ssid,
@@ -37,37 +97,133 @@ class ProbeRequest(object):
                                          '%Y-%m-%d %H:%M:%S.%f')
         return OrderedDict([('source_mac', self.source_mac),
                             ('capture_dts', dts),
-                            ('target_ssid', self.target_ssid),
+                            ('target_ssid', _decode_ssid(self.target_ssid)),
                             ('signal_strength', self.signal_strength)])
 
 
+class CoalescedRequest(ProbeRequest):
+    """A burst of requests of a device for the same SSID, e.g. sent on all
+    channels within a few milliseconds, stored as one record.
+
+    capture_us and last_us are the capture timestamps of the first and the
+    last request of the burst, signal_strength is the mean RSSi and count the
+    number of requests.
+    """
+
+    __slots__ = ('count', 'last_us', 'signal_min', 'signal_max')
+
+    def __init__(self, source_mac, capture_dts, target_ssid=None,
+                 signal_strength=None, count=1, last_dts=None,
+                 signal_min=None, signal_max=None):
+        super(CoalescedRequest, self).__init__(source_mac, capture_dts,
+                                               target_ssid, signal_strength)
+        self.count = count
+        self.last_us = self.capture_us if last_dts is None else \
+            _epoch_us(last_dts)
+        self.signal_min = signal_min
+        self.signal_max = signal_max
+
+    @classmethod
+    def from_us(cls, source_mac, capture_us, target_ssid=None,
+                signal_strength=None, count=1, last_us=None, signal_min=None,
+                signal_max=None):
+        request = super(CoalescedRequest, cls).from_us(
+            source_mac, capture_us, target_ssid, signal_strength)
+        request.count = count
+        request.last_us = capture_us if last_us is None else last_us
+        request.signal_min = signal_min
+        request.signal_max = signal_max
+        return request
+
+    @property
+    def last_dts(self):
+        if self.last_us is None:
+            return None
+        return _from_epoch_us(self.last_us)
+
+    def __str__(self):
+        return "{}, count={}".format(super(CoalescedRequest, self).__str__(),
+                                     self.count)
+
+    def __jdict__(self):
+        jdict = super(CoalescedRequest, self).__jdict__()
+        jdict['count'] = self.count
+        jdict['last_dts'] = _strftime(self.last_dts)
+        jdict['signal_min'] = self.signal_min
+        jdict['signal_max'] = self.signal_max
+        return jdict
+
+
 class Device(object):
+    """A device and the SSIDs it has been looking for.
+
+    ssid_stats maps the known SSIDs, in the order they were first requested,
+    to a list of first_seen and last_seen (microseconds since the epoch, None
+    if unknown) and the number of requests.
+    """
+
+    __slots__ = ('device_mac', 'ssid_stats', 'vendor_company',
+                 'vendor_country', 'last_seen_us', 'alias')
 
     def __init__(self, device_mac, last_seen_dts=None, known_ssids=None,
                  vendor_company=None, vendor_country=None, alias=None):
         self.device_mac = device_mac
-        self.known_ssids = known_ssids if known_ssids else []
+        self.ssid_stats = OrderedDict()
+        for ssid in known_ssids if known_ssids else []:
+            self.ssid_stats[ssid] = [None, None, 0]
         self.vendor_company = vendor_company
         self.vendor_country = vendor_country
         self.last_seen_dts = last_seen_dts
         self.alias = alias
 
-    def set_vendor(self, session=None):
+    @property
+    def known_ssids(self):
+        return list(self.ssid_stats)
+
+    @property
+    def last_seen_dts(self):
+        if self.last_seen_us is None:
+            return None
+        return _from_epoch_us(self.last_seen_us)
+
+    @last_seen_dts.setter
+    def last_seen_dts(self, last_seen_dts):
+        self.last_seen_us = None if last_seen_dts is None else \
+            _epoch_us(last_seen_dts)
+
+    def set_vendor(self, session=None, database=None, online=True,
+                   cache=None):
         """Set the vendor of this device. The vendor can be looked up by the
         devices mac address.
 
         Keyword arguments:
         session -- HTTPS session with connections which should be reused for the
                    requests neccesary for the lookup.
+        database -- OuiDatabase, which is asked before the online lookup
+        online -- look up vendors online, which are not in the database
+        cache -- VendorCache of online lookups
         """
-        try:
-            vendor = _lookup_vendor(self.device_mac, session)
-            self.vendor_company = vendor['company']
-            self.vendor_country = vendor['country']
-        except Exception:
-            log.warn("Unable to lookup vendor for: {}".format(self.device_mac))
+        vendor = database.lookup(self.device_mac) if database else None
+        if vendor is None and online:
+            cached, vendor = cache.get(self.device_mac) if cache else \
+                (False, None)
+            if not cached:
+                try:
+                    vendor = _lookup_vendor(self.device_mac, session)
+                    if cache:
+                        cache.put(self.device_mac, vendor)
+                except Exception:
+                    log.warn("Unable to lookup vendor for: {}".format(
+                        self.device_mac))
+                    if cache:
+                        cache.fail(self.device_mac)
+        if vendor is None:
             self.vendor_company = None
             self.vendor_country = None
+            return False
+        self.vendor_company = vendor['company']
+        self.vendor_country = vendor['country']
+        return True
 
     def set_alias(self, alias):
         if not self.alias:
@@ -75,13 +231,17 @@ class Device(object):
             log.debug("Set alias of device ({}) to: {}".format(self.device_mac,
                                                                self.alias))
 
-    def add_ssid(self, ssid):
-        """Add a new SSID to the device.
+    def add_ssid(self, ssid, capture_us=None, last_us=None, count=1):
+        """Add a new SSID to the device or update its stats.
 
         ssid -- string object
+        capture_us -- capture timestamp of the request for the SSID
+        last_us -- last capture timestamp of coalesced requests
+        count -- number of coalesced requests
         """
-        if ssid and ssid not in self.known_ssids:
-            self.known_ssids.append(ssid)
+        last_us = capture_us if last_us is None else last_us
+        if ssid and _add_seen(self.ssid_stats, ssid, capture_us, last_us,
+                              count):
             log.debug('SSID added to device:{}'.format(ssid))
 
     def __str__(self):
@@ -90,28 +250,43 @@ class Device(object):
                                                    self.vendor_country)
 
     def __jdict__(self):
-        dts = datetime.datetime.strftime(self.last_seen_dts,
-                                         '%Y-%m-%d %H:%M:%S.%f')
+        # devices which were looked up but never seen have no last_seen_dts:
         return OrderedDict([('device_mac', self.device_mac),
                             ('alias', self.alias),
                             ('known_ssids', self.known_ssids),
-                            ('last_seen_dts', dts),
+                            ('last_seen_dts', _strftime(self.last_seen_dts)),
                             ('vendor_company', self.vendor_company),
-                            ('vendor_country', self.vendor_country)])
+                            ('vendor_country', self.vendor_country),
+                            ('ssid_stats', _stats_jdict(self.ssid_stats))])
 
 
 class Station(object):
+    """A station (SSID) and the devices looking for it.
+
+    device_stats maps the associated devices, in the order they first
+    requested the SSID, to a list of first_seen and last_seen (microseconds
+    since the epoch, None if unknown) and the number of requests.
+    """
+
+    __slots__ = ('ssid', 'device_stats')
 
     def __init__(self, ssid, associated_devices=None):
         self.ssid = ssid
-        self.associated_devices = []
-        if associated_devices:
-            self.associated_devices = associated_devices
-
-    def add_device(self, device_mac):
-        """Add a known assoiciated device to the station."""
-        if device_mac and device_mac not in self.associated_devices:
-            self.associated_devices.append(device_mac)
+        self.device_stats = OrderedDict()
+        for device_mac in associated_devices if associated_devices else []:
+            self.device_stats[device_mac] = [None, None, 0]
+
+    @property
+    def associated_devices(self):
+        return list(self.device_stats)
+
+    def add_device(self, device_mac, capture_us=None, last_us=None, count=1):
+        """Add a known assoiciated device to the station or update its stats.
+        last_us and count describe coalesced requests, like in add_ssid.
+        """
+        last_us = capture_us if last_us is None else last_us
+        if device_mac and _add_seen(self.device_stats, device_mac, capture_us,
+                                    last_us, count):
             log.debug("Device added to station:{}@'{}'".format(device_mac,
                                                                self.ssid))
 
@@ -120,67 +295,669 @@ class Station(object):
 
     def __jdict__(self):
         return OrderedDict([('ssid', self.ssid),
-                            ('associated_devices', self.associated_devices)])
+                            ('associated_devices', self.associated_devices),
+                            ('device_stats', _stats_jdict(self.device_stats))])
+
+
+def _add_seen(stats, key, first_us, last_us, count=1):
+    """Add an element to an ordered dict of [first_seen, last_seen, count]
+    stats, or merge the stats if it exists. Returns True for new elements."""
+    seen = stats.get(key)
+    if seen is None:
+        stats[key] = [first_us, last_us, count]
+        return True
+    if first_us is not None and (seen[0] is None or first_us < seen[0]):
+        seen[0] = first_us
+    if last_us is not None and (seen[1] is None or seen[1] < last_us):
+        seen[1] = last_us
+    seen[2] += count
+    return False
+
+
+def _stats_jdict(stats):
+    jdict = OrderedDict()
+    for key, (first_us, last_us, count) in stats.items():
+        jdict[key] = OrderedDict([
+            ('first_seen', _strftime(_from_epoch_us(first_us))
+             if first_us is not None else None),
+            ('last_seen', _strftime(_from_epoch_us(last_us))
+             if last_us is not None else None),
+            ('count', count)])
+    return jdict
+
+
+class Snapshot(object):
+    """Aggregated devices and stations of all requests, which have been written
+    to the request file up to a position (offset).
+
+    A persisted snapshot allows queries to replay only the requests written
+    after the snapshot was taken, instead of reading the whole request file.
+    """
+
+    def __init__(self, offset=0, max_dts=None, devices=None, stations=None):
+        self.offset = offset
+        self.max_dts = max_dts
+        self.devices = devices if devices else {}
+        self.stations = stations if stations else {}
+
+    @property
+    def max_dts(self):
+        return None if self.max_us is None else _from_epoch_us(self.max_us)
+
+    @max_dts.setter
+    def max_dts(self, max_dts):
+        self.max_us = None if max_dts is None else _epoch_us(max_dts)
+
+    def add_request(self, request, escape_ssid=None):
+        """Update the aggregated devices and stations with a request.
+
+        Keyword arguments:
+        escape_ssid -- function converting the SSID of a captured request to
+                       the form in which it is read from the storage
+        """
+        id = request.source_mac
+        capture_us = request.capture_us
+        last_us = request.last_us
+        ssid = request.target_ssid
+        if ssid and escape_ssid:
+            ssid = escape_ssid(ssid)
+        device = self.devices.get(id)
+        if device is None:
+            device = self.devices[id] = Device(id)
+            device.last_seen_us = last_us
+        if ssid:
+            device.add_ssid(ssid, capture_us, last_us, request.count)
+            if ssid not in self.stations:
+                self.stations[ssid] = Station(ssid)
+            self.stations[ssid].add_device(id, capture_us, last_us,
+                                           request.count)
+        if device.last_seen_us < last_us:
+            device.last_seen_us = last_us
+        if self.max_us is None or self.max_us < last_us:
+            self.max_us = last_us
+
+    def merge(self, devices, stations):
+        """Update the aggregated devices and stations with devices and
+        stations aggregated from newer requests."""
+        for id, device in devices.items():
+            if id not in self.devices:
+                self.devices[id] = device
+            else:
+                stats = self.devices[id].ssid_stats
+                for ssid, seen in device.ssid_stats.items():
+                    _add_seen(stats, ssid, *seen)
+                if self.devices[id].last_seen_us < device.last_seen_us:
+                    self.devices[id].last_seen_us = device.last_seen_us
+            if self.max_us is None or self.max_us < device.last_seen_us:
+                self.max_us = device.last_seen_us
+        for ssid, station in stations.items():
+            if ssid not in self.stations:
+                self.stations[ssid] = station
+            else:
+                stats = self.stations[ssid].device_stats
+                for device_mac, seen in station.device_stats.items():
+                    _add_seen(stats, device_mac, *seen)
+
+    @classmethod
+    def load(cls, filename):
+        """Load a persisted snapshot. An empty snapshot is returned if the file
+        does not exist or can not be decoded."""
+        try:
+            with open(filename) as file:
+                return cls.from_dump(json.load(file))
+        except IOError:
+            return cls()
+        except Exception as e:
+            log.warn("Unable to load snapshot {}: {}".format(filename, e))
+            return cls()
+
+    @classmethod
+    def from_dump(cls, dump):
+        """Create a snapshot from the decoded JSON of to_dump."""
+        devices = {}
+        for id, last_seen_dts, ssid_stats in dump['devices']:
+            devices[id] = Device(id, last_seen_dts=_strptime(last_seen_dts))
+            _load_stats(devices[id].ssid_stats, ssid_stats)
+        stations = {}
+        for ssid, device_stats in dump['stations']:
+            stations[ssid] = Station(ssid)
+            _load_stats(stations[ssid].device_stats, device_stats)
+        max_dts = dump['max_dts']
+        return cls(offset=dump['offset'],
+                   max_dts=_strptime(max_dts) if max_dts else None,
+                   devices=devices, stations=stations)
+
+    def to_dump(self):
+        """Return the snapshot as JSON serializable dict. The stats are
+        copied, so the dict can be serialized while the snapshot changes."""
+        devices = [[d.device_mac, _strftime(d.last_seen_dts),
+                    [[ssid] + seen for ssid, seen in d.ssid_stats.items()]]
+                   for d in self.devices.values()]
+        stations = [[s.ssid, [[device_mac] + seen for device_mac, seen
+                              in s.device_stats.items()]]
+                    for s in self.stations.values()]
+        return OrderedDict([('offset', self.offset),
+                            ('max_dts', _strftime(self.max_dts)),
+                            ('devices', devices),
+                            ('stations', stations)])
+
+    def save(self, filename):
+        """Persist the snapshot. The file is replaced atomically."""
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as file:
+            json.dump(self.to_dump(), file, separators=(',', ':'))
+        os.rename(tmp_filename, filename)
+
+
+def _load_stats(stats, dump):
+    """Load [key, first_seen, last_seen, count] lists of a snapshot. Older
+    snapshots only contain the keys."""
+    for entry in dump:
+        if isinstance(entry, list):
+            stats[entry[0]] = entry[1:]
+        else:
+            stats[entry] = [None, None, 0]
+
+
+class RequestWriter(object):
+    """Buffered writer for a request file.
+
+    Serialized requests are collected in memory and appended to the file in
+    batches. The buffer is flushed as soon as it holds more than max_bytes or
+    its oldest entry is older than max_delay seconds. The file stays open
+    until the writer is closed.
+
+    Functions in listeners are called after each flush with a list of
+    (offset, request) tuples of the written requests and the new end of the
+    file.
+
+    Keyword arguments:
+    separator -- string written before each serialized request
+    max_bytes -- size limit of the buffer in bytes
+    max_delay -- time limit in seconds, after which buffered requests are
+                 flushed even if the size limit has not been reached
+    """
+
+    def __init__(self, filename, separator='\n', max_bytes=64 * 1024,
+                 max_delay=1.0):
+        self.filename = filename
+        self.separator = separator
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        # counters:
+        self.bytes_written = 0
+        self.records_written = 0
+        self.flush_count = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        self._buffer = []
+        # the requests of the buffered entries, passed to the listeners:
+        self._requests = []
+        self._buffer_bytes = 0
+        self._buffer_since = None
+        self._file = None
+        self._lock = RLock()
+        self._timer = None
+        self.listeners = []
+
+    def write(self, dump, request=None):
+        """Append one serialized request to the buffer."""
+        data = self.separator + dump
+        self._add(data, len(data), request)
+
+    def _add(self, data, size, request=None):
+        """Append an entry of about size bytes for a request to the
+        buffer."""
+        with self._lock:
+            if self._timer is None and self.max_delay:
+                self._timer = _FlushTimer(self)
+                self._timer.start()
+            if self._buffer_since is None:
+                self._buffer_since = time.time()
+            self._buffer.append(data)
+            self._requests.append(request)
+            self._buffer_bytes += size
+            if self._buffer_bytes >= self.max_bytes or self._expired():
+                self.flush()
+
+    def _expired(self):
+        return (self._buffer_since is not None and bool(self.max_delay) and
+                time.time() - self._buffer_since >= self.max_delay)
+
+    def flush_expired(self):
+        """Flush the buffer if the time limit has been reached."""
+        with self._lock:
+            if self._expired():
+                self.flush()
+
+    def flush(self):
+        """Write all buffered requests to the request file."""
+        with self._lock:
+            if not self._buffer:
+                return
+            start = time.time()
+            size, batch, position = self._write_buffer()
+            elapsed = time.time() - start
+            for listener in self.listeners:
+                try:
+                    listener(batch, position)
+                except Exception as e:
+                    log.error("Flush listener failed: {}".format(e))
+            self.bytes_written += size
+            self.records_written += len(self._buffer)
+            self.flush_count += 1
+            FLUSH_SECONDS.observe(elapsed)
+            self.flush_seconds_total += elapsed
+            self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+            log.debug("flushed {} requests in {:.6f}s".format(
+                len(self._buffer), elapsed))
+            self._buffer = []
+            self._requests = []
+            self._buffer_bytes = 0
+            self._buffer_since = None
+
+    def _write_buffer(self):
+        """Append the buffered requests to the request file. Returns the
+        number of written bytes, the (offset, request) tuples of the requests
+        and the position after them."""
+        if self._file is None:
+            self._file = open(self.filename, 'ab')
+        self._file.seek(0, os.SEEK_END)
+        data, batch, position = self._pack(self._file.tell())
+        self._file.write(data)
+        self._file.flush()
+        return len(data), batch, position
+
+    def _pack(self, position):
+        """Return the data to append to the file at the given position for
+        the buffered requests, the (offset, request) tuples of the requests
+        and the position after the data."""
+        batch = []
+        skip = len(self.separator)
+        for data, request in zip(self._buffer, self._requests):
+            batch.append((position + skip, request))
+            position += len(data)
+        return ''.join(self._buffer), batch, position
+
+    def switch(self, filename):
+        """Flush the buffer and continue writing to another file."""
+        with self._lock:
+            self.flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.filename = filename
+
+    def close(self):
+        """Flush the buffer, stop the flush timer and close the file."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.stop()
+                self._timer = None
+            self.flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self):
+        """Return the counters of this writer."""
+        with self._lock:
+            mean = (self.flush_seconds_total / self.flush_count
+                    if self.flush_count else 0.0)
+            return OrderedDict([('bytes_written', self.bytes_written),
+                                ('records_written', self.records_written),
+                                ('buffered_records', len(self._buffer)),
+                                ('flush_count', self.flush_count),
+                                ('flush_seconds_mean', mean),
+                                ('flush_seconds_max', self.flush_seconds_max)])
+
+
+class _FlushTimer(Thread):
+    """Helper thread which enforces the time limit of a RequestWriter, even if
+    no further requests are written."""
+
+    def __init__(self, writer):
+        super(_FlushTimer, self).__init__()
+        self.setDaemon(True)
+        self.writer = writer
+        self._stopped = Event()
+
+    def run(self):
+        interval = self.writer.max_delay / 2.0
+        while not self._stopped.wait(interval):
+            self.writer.flush_expired()
+
+    def stop(self):
+        self._stopped.set()
 
 
 class Tracker(object):
+    """Stores captured requests and aggregates them to devices and stations.
 
-    def __init__(self, storage_dir):
+    Keyword arguments:
+    storage -- name of the storage backend (see wifitracker.storage)
+    storage_options -- dict of additional arguments of the storage backend
+    engine -- how requests are aggregated: 'numpy' (see wifitracker.arrays),
+              'python' or 'auto' to use numpy if it is installed and the
+              storage provides the columns natively (binary)
+    jobs -- number of processes, which decode and aggregate requests in
+            parallel when the whole storage is scanned (see
+            wifitracker.parallel)
+    live -- answer queries of all requests from the live aggregate of a
+            running sniffer, if there is one (see wifitracker.live)
+    """
+
+    def __init__(self, storage_dir, buffer_size=64 * 1024, flush_interval=1.0,
+                 index=True, storage='json', storage_options=None,
+                 engine='auto', jobs=1, live=True):
+        # imported here, since these modules depend on this module:
+        from wifitracker.storage import open_storage
+        from wifitracker import arrays
+        if engine == 'numpy' and not arrays.available():
+            raise ValueError("The numpy engine requires numpy.")
+        self.jobs = jobs
+        self.live = live
         self.storage_dir = storage_dir
-        self.request_filename = os.path.join(self.storage_dir, 'requests')
+        self.storage_options = storage_options or {}
+        self.storage = open_storage(storage, storage_dir,
+                                    buffer_size=buffer_size,
+                                    flush_interval=flush_interval,
+                                    **self.storage_options)
+        if engine == 'auto':
+            # building the columns of other storages costs more than the
+            # vectorized aggregation saves:
+            engine = 'numpy' if arrays.available() and \
+                arrays.native(self.storage) else 'python'
+        self.arrays = arrays if engine == 'numpy' else None
+        self.request_filename = self.storage.filename
         self.alias_filename = os.path.join(self.storage_dir, 'aliases.csv')
+        self.index_filename = self.request_filename + '.idx'
+        self.snapshot_filename = self.request_filename + '.snapshot'
+        self.live_filename = self.request_filename + '.sock'
+        self.index = RequestIndex(self.index_filename)
+        # storages with a find method index the requests themselves:
+        if index and not hasattr(self.storage, 'find'):
+            self.storage.listeners.append(self._index_flushed)
 
     def add_request(self, request):
-        """Add the captured request to the tracker. The tracker might store this
-        request in a file or database backend.
+        """Add the captured request to the tracker. The tracker stores this
+        request in its storage backend (see wifitracker.storage).
         """
-        # TODO: store in mongodb/send over REST
+        start = time.time()
         self._write_request(request)
+        ADD_REQUEST_SECONDS.since(start)
+
+    def add_requests(self, requests):
+        """Add many requests at once, e.g. requests imported from a file."""
+        for request in requests:
+            self._write_request(request)
 
     def _write_request(self, request):
-        dump = json_compact(request)
-        with open(self.request_filename, 'a') as file:
-            file.write('\n' + dump)
+        self.storage.append(request)
 
-    def get_devices(self, load_dts=None, aliases=None):
-        """Load a version of all devices valid at the given timestamp."""
-        devices = {}
+    def flush(self):
+        """Write all buffered requests to the storage backend."""
+        self.storage.flush()
+
+    def close(self):
+        """Flush buffered requests and release open files."""
+        self.storage.close()
+        self.index.close()
+
+    def stats(self):
+        """Return the counters of the request writer."""
+        return self.storage.stats()
+
+    def compact(self, retention=None):
+        """Compress old requests and remove requests older than the retention
+        period (timedelta), if the storage backend supports it. The index and
+        the snapshot are rebuilt if requests were removed.
+        """
+        if not hasattr(self.storage, 'compact'):
+            raise ValueError("The {} storage does not support compaction."
+                             .format(self.storage.name))
+        removed = self.storage.compact(retention=retention)
+        if removed:
+            if os.path.exists(self.snapshot_filename):
+                os.remove(self.snapshot_filename)
+            if os.path.exists(self.index_filename):
+                self.index.clear()
+                self.update_index()
+        return removed
+
+    def update_index(self, chunk_size=10000):
+        """Add all requests to the index, which have been written to the
+        request file since the last update.
+        """
+        if hasattr(self.storage, 'find'):
+            log.info("The {} storage indexes requests itself.".format(
+                self.storage.name))
+            return
+        start = self.index.end()
+        if not self.storage.exists():
+            return
+        if self.storage.size() < start:
+            log.warn("Request file is smaller than its index, rebuilding.")
+            self.index.clear()
+            start = 0
+        for entries, end in self.storage.read_tail(start, chunk_size):
+            self.index.add(entries, end)
+
+    def _index_flushed(self, batch, end):
+        """Flush listener, which adds written requests to the index."""
+        start = batch[0][0] - len(self.storage.separator)
+        if self.index.end() != start:
+            # some requests were written without updating the index:
+            self.update_index()
+            return
+        # the SSIDs are indexed the way they are read from the storage:
+        self.index.add(batch, end, self.storage.escape_ssid)
+
+    def _seek(self, since):
+        """Return the position from which requests captured since the given
+        timestamp have to be read. The sparse timestamp index of the
+        RequestIndex is used, if it exists."""
+        if since and os.path.exists(self.index_filename):
+            return self.index.seek(since)
+        return 0
+
+    def _find_requests(self, field, key, load_dts=None, since=None):
+        """Yield chunks of requests with the given value of field (source_mac
+        or target_ssid), which were captured before load_dts and not before
+        since.
+
+        If the index exists, only the indexed matching requests and the not yet
+        indexed end of the request file are read. Lines of the request file,
+        which can not match the key, are skipped without decoding them.
+        Storages with a find method look up the requests themselves.
+        """
+        if hasattr(self.storage, 'find'):
+            for request_chunk in self.storage.find(field, key, load_dts,
+                                                   since):
+                yield request_chunk
+            return
+        match = _match_token(key)
+        if not os.path.exists(self.index_filename):
+            for request_chunk in self._read_requests_chunk(
+                    load_dts, since=since, match=match):
+                yield [r for r in request_chunk if getattr(r, field) == key]
+            return
+        if not load_dts:
+            load_dts = datetime.datetime.now()
+        end = self.index.end()
+        start = self._seek(since)
+        offsets = [o for o in self.index.lookup(field, key) if o >= start]
+        for i in xrange(0, len(offsets), 10000):
+            requests = self.storage.read_at(offsets[i:i + 10000])
+            yield _filter_requests(requests, load_dts, since)
+        for request_chunk in self._read_requests_chunk(load_dts, start=end,
+                                                       since=since,
+                                                       match=match):
+            yield [r for r in request_chunk if getattr(r, field) == key]
+
+    def get_snapshot(self, load_dts=None):
+        """Load the persisted snapshot and update it with all requests written
+        since it was taken. The updated snapshot is persisted again.
+
+        None is returned if the snapshot contains requests captured after
+        load_dts, since it can not represent an older version of the devices
+        and stations.
+        """
+        if not load_dts:
+            load_dts = datetime.datetime.now()
+        if not self.storage.exists():
+            return None
+        snapshot = Snapshot.load(self.snapshot_filename)
+        if self.storage.size() < snapshot.offset:
+            log.warn("Request file is smaller than the snapshot, rebuilding.")
+            snapshot = Snapshot()
+        offset = snapshot.offset
+        if hasattr(self.storage, 'aggregate'):
+            devices, stations, snapshot.offset = self.storage.aggregate(
+                offset)
+            snapshot.merge(devices, stations)
+        elif self.jobs > 1:
+            self._scan_parallel(offset, snapshot=snapshot)
+        elif self.arrays:
+            columns = self.arrays.load_columns(self.storage, offset)
+            if len(columns):
+                snapshot.merge(*self.arrays.aggregate(columns))
+            snapshot.offset = columns.end
+        else:
+            for entries, end in self.storage.read_tail(offset):
+                for position, request in entries:
+                    snapshot.add_request(request)
+                snapshot.offset = end
+        if snapshot.offset != offset:
+            try:
+                snapshot.save(self.snapshot_filename)
+            except (IOError, OSError) as e:
+                log.warn("Unable to save snapshot: {}".format(e))
+        if snapshot.max_dts and snapshot.max_dts >= load_dts:
+            return None
+        return snapshot
+
+    def _query_live(self, query, id=None, load_dts=None, since=None):
+        """Query the live aggregate of a running sniffer. None is returned if
+        no sniffer is running or the query is restricted to a time range,
+        since the live aggregate covers all requests up to now."""
+        if not self.live or load_dts or since:
+            return None
+        from wifitracker import live
+        return live.query(self.live_filename, query, id)
+
+    def get_devices(self, load_dts=None, aliases=None, since=None,
+                    until=None):
+        """Load a version of all devices valid at the given timestamp.
+
+        Keyword arguments:
+        since -- only consider requests captured since this timestamp
+        until -- only consider requests captured before this timestamp,
+                 overrides load_dts
+        """
         aliases = {} if not aliases else aliases
-        for request_chunk in self._read_requests_chunk(load_dts):
+        load_dts = until if until else load_dts
+        snapshot = self._query_live('devices', load_dts=load_dts, since=since)
+        # the snapshot aggregates all requests, regardless of since:
+        if snapshot is None and not since:
+            snapshot = self.get_snapshot(load_dts)
+        if snapshot:
+            devices = snapshot.devices
+        else:
+            devices = self._scan_devices(load_dts, since)
+        for id in devices:
+            if id in aliases:
+                devices[id].set_alias(aliases[id])
+        return devices
+
+    def _scan_parallel(self, start, load_dts=None, since=None, snapshot=None):
+        from wifitracker import parallel
+        return parallel.scan(self.storage, self.storage_dir,
+                             self.storage_options, self.jobs, start,
+                             load_dts, since, snapshot)
+
+    def _scan_devices(self, load_dts=None, since=None):
+        start = self._seek(since)
+        if hasattr(self.storage, 'aggregate'):
+            if not load_dts:
+                load_dts = datetime.datetime.now()
+            return self.storage.aggregate(start, load_dts, since)[0]
+        if self.jobs > 1:
+            if not load_dts:
+                load_dts = datetime.datetime.now()
+            return self._scan_parallel(start, load_dts, since).devices
+        if self.arrays:
+            columns = self.arrays.load_columns(self.storage, start)
+            return self.arrays.aggregate(columns, load_dts, since)[0]
+        devices = {}
+        for request_chunk in self._read_requests_chunk(load_dts, start=start,
+                                                       since=since):
             for request in request_chunk:
                 id = request.source_mac
-                capture_dts = request.capture_dts
+                last_us = request.last_us
                 ssid = request.target_ssid
                 if id not in devices:
-                    devices[id] = Device(id, last_seen_dts=capture_dts)
+                    devices[id] = Device(id)
+                    devices[id].last_seen_us = last_us
                     log.debug("new device: {}".format(devices[id]))
-                    if id in aliases:
-                        devices[id].set_alias(aliases[id])
                 if ssid:
-                    devices[id].add_ssid(ssid)
-                if devices[id].last_seen_dts < capture_dts:
-                    devices[id].last_seen_dts = capture_dts
+                    devices[id].add_ssid(ssid, request.capture_us, last_us,
+                                         request.count)
+                if devices[id].last_seen_us < last_us:
+                    devices[id].last_seen_us = last_us
         return devices
 
-    def get_device(self, device_mac, load_dts=None, alias=None):
+    def get_device(self, device_mac, load_dts=None, alias=None, since=None,
+                   until=None):
+        load_dts = until if until else load_dts
+        snapshot = self._query_live('device', device_mac, load_dts, since)
+        if snapshot is not None:
+            device = snapshot.devices.get(device_mac, Device(device_mac))
+            device.alias = alias
+            return device
         device = Device(device_mac, alias=alias)
-        for request_chunk in self._read_requests_chunk(load_dts):
-            device_requests = [r for r in request_chunk
-                               if r.source_mac == device_mac]
+        for device_requests in self._find_requests('source_mac', device_mac,
+                                                   load_dts, since):
             for request in device_requests:
                 if request.target_ssid:
-                    device.add_ssid(request.target_ssid)
-            try:
-                device.last_seen_dts = device_requests[-1].capture_dts
-            except IndexError:
-                # ignore if list is empty
-                pass
+                    device.add_ssid(request.target_ssid, request.capture_us,
+                                    request.last_us, request.count)
+                if device.last_seen_us < request.last_us:
+                    device.last_seen_us = request.last_us
         return device
 
-    def get_stations(self, load_dts=None):
-        """Load a version of all stations valid at the given timestamp."""
+    def get_stations(self, load_dts=None, since=None, until=None):
+        """Load a version of all stations valid at the given timestamp.
+
+        Keyword arguments:
+        since -- only consider requests captured since this timestamp
+        until -- only consider requests captured before this timestamp,
+                 overrides load_dts
+        """
+        load_dts = until if until else load_dts
+        snapshot = self._query_live('stations', load_dts=load_dts, since=since)
+        if snapshot is None and not since:
+            snapshot = self.get_snapshot(load_dts)
+        if snapshot:
+            return snapshot.stations
+        return self._scan_stations(load_dts, since)
+
+    def _scan_stations(self, load_dts=None, since=None):
+        start = self._seek(since)
+        if hasattr(self.storage, 'aggregate'):
+            if not load_dts:
+                load_dts = datetime.datetime.now()
+            return self.storage.aggregate(start, load_dts, since)[1]
+        if self.jobs > 1:
+            if not load_dts:
+                load_dts = datetime.datetime.now()
+            return self._scan_parallel(start, load_dts, since).stations
+        if self.arrays:
+            columns = self.arrays.load_columns(self.storage, start)
+            return self.arrays.aggregate(columns, load_dts, since)[1]
         stations = {}
-        for request_chunk in self._read_requests_chunk(load_dts):
+        for request_chunk in self._read_requests_chunk(load_dts, start=start,
+                                                       since=since):
             for request in request_chunk:
                 ssid = request.target_ssid
                 device_mac = request.source_mac
@@ -188,20 +965,46 @@ class Tracker(object):
                     if ssid not in stations:
                         stations[ssid] = Station(ssid)
                         log.debug("new station: {}".format(stations[ssid]))
-                    stations[ssid].add_device(device_mac)
+                    stations[ssid].add_device(device_mac, request.capture_us,
+                                              request.last_us, request.count)
         return stations
 
-    def get_station(self, ssid, load_dts=None):
+    def get_station(self, ssid, load_dts=None, since=None, until=None):
+        load_dts = until if until else load_dts
+        snapshot = self._query_live('station', ssid, load_dts, since)
+        if snapshot is not None:
+            return snapshot.stations.get(ssid, Station(ssid))
         station = Station(ssid)
-        for request_chunk in self._read_requests_chunk(load_dts):
-            station_requests = [r for r in request_chunk
-                                if r.target_ssid == ssid]
+        for station_requests in self._find_requests('target_ssid', ssid,
+                                                    load_dts, since):
             for request in station_requests:
                 device_mac = request.source_mac
-                station.add_device(device_mac)
+                station.add_device(device_mac, request.capture_us,
+                                   request.last_us, request.count)
         return station
 
+    def get_requests(self, device_mac=None, load_dts=None, since=None,
+                     until=None):
+        """Yield the requests captured before load_dts (and not before since)
+        one by one, while the storage is read. If device_mac is given, only
+        the requests of this device are yielded.
+        """
+        load_dts = until if until else load_dts
+        if device_mac:
+            chunks = self._find_requests('source_mac', device_mac, load_dts,
+                                         since)
+        else:
+            chunks = self._read_requests_chunk(load_dts,
+                                               start=self._seek(since),
+                                               since=since)
+        for request_chunk in chunks:
+            for request in request_chunk:
+                yield request
+
     def get_aliases(self):
+        if hasattr(self.storage, 'get_aliases'):
+            # stored in the database of the storage
+            return self.storage.get_aliases()
         aliases = {}
         with open(self.alias_filename, 'rb') as csvfile:
             reader = csv.reader(csvfile, delimiter=';', quotechar='"')
@@ -213,6 +1016,8 @@ class Tracker(object):
         aliases = self.get_aliases()
         if not force and device_mac in aliases:
             raise ValueError("Device alias already set.")
+        elif hasattr(self.storage, 'set_alias'):
+            self.storage.set_alias(device_mac, alias)
         else:
             aliases[device_mac] = alias
             with open(self.alias_filename, 'wb') as csvfile:
@@ -220,103 +1025,207 @@ class Tracker(object):
                 for d in aliases:
                     writer.writerow([d, aliases[d]])
 
-    def _read_requests_chunk(self, load_dts=None, chunk_size=10000):
-        if not load_dts:
-            load_dts = datetime.datetime.now()
-        chunk_no = 0
-        with open(self.request_filename) as file:
+    def _read_requests_chunk(self, load_dts=None, chunk_size=10000, start=0,
+                             since=None, match=None):
+        chunks = self.storage.read_chunks(load_dts, chunk_size, start, since,
+                                          match)
+        # only the time spent in the storage is measured, not the consumer:
+        elapsed = 0.0
+        try:
             while True:
-                chunk = list(islice(file, chunk_size))
-                if not chunk:
-                    break
-                chunk_no += 1
-                lines = [line for line in chunk if len(line) > 1]
+                chunk_start = time.time()
                 try:
-                    all = _load_requests('[' + ','.join(lines) + ']')
-                except:
-                    # try to decode line by line
-                    all = []
-                    i = 0
-                    for line in lines:
-                        i += 1
-                        try:
-                            all += _load_requests('[' + line + ']')
-                        except Exception:
-                            # ignore erroneous lines
-                            line_no = chunk_size * (chunk_no - 1) + i
-                            log.error("Unable to decode line at {}:{}".format(
-                                self.request_filename, line_no))
-                if all[0].capture_dts > load_dts:
-                    # abort since we assume the requests are sorted
+                    chunk = next(chunks)
+                except StopIteration:
                     break
-                yield [r for r in all if r.capture_dts < load_dts]
+                finally:
+                    elapsed += time.time() - chunk_start
+                SCAN_ROWS.inc(len(chunk))
+                yield chunk
+        finally:
+            SCAN_SECONDS.observe(elapsed)
+
+
+def _json_decoder(name=None):
+    """Return the name and the function of a decoder for lists of JSON lines:
+    orjson or ujson if they are installed, or the scanner of the json module
+    otherwise. The scanner decodes each line in place, without joining the
+    lines to one JSON array, and ignores trailing data.
+    """
+    if name in (None, 'orjson', 'ujson'):
+        for module in ('orjson', 'ujson') if name is None else (name,):
+            try:
+                loads = __import__(module).loads
+            except ImportError:
+                if name is not None:
+                    raise ValueError("The {} decoder is not installed."
+                                     .format(name))
+                continue
+            return module, lambda lines: [loads(line) for line in lines]
+    elif name != 'json':
+        raise ValueError("Unknown JSON decoder: {}".format(name))
+    scan_once = json.JSONDecoder().scan_once
+    # raises StopIteration for lines without a JSON value:
+    return 'json', lambda lines: [scan_once(line, 0)[0] for line in lines]
+
+
+def set_json_decoder(name=None):
+    """Select the decoder of the request lines by name (orjson, ujson or
+    json), or the fastest installed one if name is None."""
+    global JSON_DECODER, _decode_json_lines
+    JSON_DECODER, _decode_json_lines = _json_decoder(name)
+
+
+JSON_DECODER, _decode_json_lines = _json_decoder()
 
+# SSIDs of decoded requests, escaped like repr(), by decoded SSID:
+_ESCAPED_SSIDS = {}
 
-def _load_requests(dump):
-    decoded = json.loads(dump)
+
+def _decode_ssid(ssid):
+    """Decode a captured SSID, which is not valid UTF-8 in every case."""
+    if isinstance(ssid, str):
+        return ssid.decode('utf-8', 'replace')
+    return ssid
+
+
+def _escape_ssid(ssid):
+    """Escape a captured SSID like the SSIDs decoded from JSON lines (see
+    _load_requests). All storages return the SSIDs escaped this way."""
+    ssid = _decode_ssid(ssid)
+    escaped = _ESCAPED_SSIDS.get(ssid)
+    if escaped is None:
+        escaped = repr(ssid)[2:-1]
+    return escaped
+
+
+def _load_requests(decoded):
     requests = []
     for d in decoded:
         try:
-            capture_dts = _strptime(d['capture_dts'])
+            capture_us = _strptime_us(d['capture_dts'])
         except:
-            capture_dts = None
+            capture_us = None
         target_ssid = d['target_ssid']
         if target_ssid:
-            target_ssid = repr(target_ssid)[2:-1]
-        request = ProbeRequest(d['source_mac'], capture_dts,
-                               target_ssid=target_ssid,
-                               signal_strength=d['signal_strength'])
+            escaped = _ESCAPED_SSIDS.get(target_ssid)
+            if escaped is None:
+                if len(_ESCAPED_SSIDS) > 100000:
+                    _ESCAPED_SSIDS.clear()
+                escaped = _ESCAPED_SSIDS[target_ssid] = \
+                    repr(target_ssid)[2:-1]
+            target_ssid = escaped
+        if 'count' in d:
+            last_dts = d['last_dts']
+            request = CoalescedRequest.from_us(
+                d['source_mac'], capture_us, target_ssid=target_ssid,
+                signal_strength=d['signal_strength'], count=d['count'],
+                last_us=_strptime_us(last_dts) if last_dts else None,
+                signal_min=d['signal_min'], signal_max=d['signal_max'])
+        else:
+            request = ProbeRequest.from_us(
+                d['source_mac'], capture_us, target_ssid=target_ssid,
+                signal_strength=d['signal_strength'])
         requests.append(request)
     return requests
 
 
+def _filter_requests(requests, load_dts, since=None):
+    """Select the requests captured before load_dts and not before since."""
+    load_us = _epoch_us(load_dts)
+    if since:
+        since_us = _epoch_us(since)
+        return [r for r in requests if since_us <= r.capture_us < load_us]
+    return [r for r in requests if r.capture_us < load_us]
+
+
+def _load_request_lines(lines):
+    """Decode a list of lines of the request file with the selected JSON
+    decoder (see set_json_decoder). The returned list contains None for each
+    line which could not be decoded.
+    """
+    try:
+        return _load_requests(_decode_json_lines(lines))
+    except Exception:
+        # try to decode line by line
+        requests = []
+        for line in lines:
+            try:
+                requests += _load_requests(_decode_json_lines([line]))
+            except Exception:
+                requests.append(None)
+        return requests
+
+
+def _match_token(key):
+    """Return the JSON string of a source_mac or target_ssid, which occurs
+    in each line of a request with this value. Lines without it can be
+    skipped without decoding them. None is returned for values which might
+    be escaped differently in the request file.
+    """
+    if not key or not all(' ' <= c <= '~' and c not in '"\\' for c in key):
+        return None
+    return '"' + key + '"'
+
+
 def _lookup_vendor(device_mac, session=None):
     session = session if session else requests.Session()
-    lookup_url = 'https://www.macvendorlookup.com/api/v2/' + device_mac
+    lookup_url = LOOKUP_URL.format(device_mac)
     vendor_response = session.get(lookup_url, timeout=10).json()[0]
     return vendor_response
 
 
-def set_vendors(devices, workers=100):
+def set_vendors(devices, workers=10, database=None, online=True,
+                cache=None, deadline=60):
     """Lookup the vendors for each device in a dict of devices.
-    The lookup requests are executed in parallel for better performance when
-    handling many devices.
+    The vendors are looked up in the database first. The remaining vendors are
+    looked up online, once per OUI. The lookup requests are executed in
+    parallel for better performance when handling many devices.
 
     Keyword arguments:
     workers -- number of lookups which should be done in parallel
+    database -- OuiDatabase (see wifitracker.oui)
+    online -- look up vendors online, which are not in the database
+    cache -- VendorCache of online lookups
+    deadline -- time limit of the online lookups in seconds
     """
+    for device in resolve_vendors(devices, workers, database, online, cache,
+                                  deadline):
+        pass
 
-    class VendorLookupThread(Thread):
-        """Helper class for concurrent vendor lookup."""
-
-        def __init__(self, queue, session):
-            super(VendorLookupThread, self).__init__()
-            self.queue = queue
-            self.session = session
 
-        def run(self):
-            while True:
-                device = self.queue.get()
-                device.set_vendor(self.session)
-                self.queue.task_done()
-
-    # the session is used to reuse https connections:
-    session = requests.Session()
-    adapter = requests.adapters.HTTPAdapter(pool_connections=workers,
-                                            pool_maxsize=workers,
-                                            pool_block=True)
-    session.mount('https://', adapter)
-
-    queue = Queue(workers)
-
-    for i in xrange(0, workers):
-        thread = VendorLookupThread(queue, session)
-        thread.setDaemon(True)
-        thread.start()
-    for id in devices:
-        queue.put(devices[id])
-    queue.join()
-    session.close()
+def resolve_vendors(devices, workers=10, database=None, online=True,
+                    cache=None, deadline=60):
+    """Lookup the vendors like set_vendors, and yield each device as soon as
+    its vendor is set. Devices found in the database are yielded first."""
+    missing = []
+    for device in devices.values():
+        if device.set_vendor(database=database, online=False):
+            VENDOR_DATABASE_HITS.inc()
+            yield device
+        elif not online:
+            yield device
+        else:
+            missing.append(device)
+    if not missing:
+        return
+    resolver = VendorResolver(concurrency=workers, cache=cache,
+                              deadline=deadline)
+    start = time.time()
+    vendors = resolver.resolve([device.device_mac for device in missing])
+    VENDOR_RESOLVE_SECONDS.since(start)
+    VENDOR_ONLINE_LOOKUPS.inc(len(missing))
+    for device in missing:
+        vendor = vendors[device.device_mac]
+        if vendor:
+            device.vendor_company = vendor['company']
+            device.vendor_country = vendor['country']
+        yield device
+    log.info("Vendor lookups: {requests} requests, {retried} retries, "
+             "{failed} failed".format(**resolver.stats()))
+    if cache:
+        log.info("Vendor cache: {hits} hits, {misses} misses "
+                 "(hit rate {hit_rate:.1%})".format(**cache.stats()))
 
 
 def _strptime(s):
@@ -332,6 +1241,40 @@ def _strptime(s):
                              microsecond=int(s[20:26]))
 
 
+def _strptime_us(s):
+    """Parse datetime strings of the format 'YYYY-MM-DD hh:mm:ss.ssssss' to
+    microseconds since the epoch, without creating datetime objects.
+    """
+    days = _EPOCH_DAYS.get(s[:10])
+    if days is None:
+        date = datetime.date(int(s[:4]), int(s[5:7]), int(s[8:10]))
+        days = _EPOCH_DAYS[s[:10]] = (date - EPOCH.date()).days
+    return (((days * 24 + int(s[11:13])) * 60 + int(s[14:16])) * 60 +
+            int(s[17:19])) * 1000000 + int(s[20:26])
+
+
+# days since the epoch of the dates parsed by _strptime_us:
+_EPOCH_DAYS = {}
+
+
+def _epoch_us(dts):
+    """Convert a datetime to microseconds since the epoch."""
+    delta = dts - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _from_epoch_us(us):
+    """Convert microseconds since the epoch to a datetime."""
+    return EPOCH + datetime.timedelta(microseconds=us)
+
+
+def _strftime(dts):
+    """Format datetimes like _strptime expects them. None is kept."""
+    if dts is None:
+        return None
+    return datetime.datetime.strftime(dts, '%Y-%m-%d %H:%M:%S.%f')
+
+
 def json_pretty(obj):
     """Generate pretty json string with indentions and spaces."""
     return json.dumps(obj.__jdict__(), indent=4, separators=(',', ': '))